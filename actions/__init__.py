@@ -1,5 +1,5 @@
 # pyright: disable
 # flake8: noqa
 
-from . import gui, simple, capture, poke
+from . import gui, simple, capture, poke, perf
 from .common import ACTIONS
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 # -- stdlib --
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import logging
 import os
@@ -16,91 +17,21 @@ import taichi as ti
 from .common import register
 from args import options, parser
 from exceptions import Failed
+from utils import imgdiff, trace
+from utils.truths import TruthStore
 
 # -- code --
 parser.add_argument('--generate-captures', action='store_true')
 parser.add_argument('--save-compare-dir', type=str, default=os.getcwd() + '/bad-compare')
+parser.add_argument('--async-compare', action='store_true', help='Compare captures in background, while the example keeps running')
+parser.add_argument('--truth-cache-dir', default='.release-tests/truths')
 
-# def _get_gaussian_coef(radius):
-#     from math import erfc
-#     a = 3.0 / radius * 0.707106781
-#     f = lambda x: 0.5*erfc(-x*a)
-#     l = [f(0.5 + i) - f(-0.5 + i) for i in range(radius+1)]
-#     l = [i for i in l if i>0.01]
-#     l = list(reversed(l[1:])) + l
-#     s = sum(l)
-#     l = [i/s for i in l]
-#     return l
-
-
-GAUSSIAN_COEFF = [
-    0.01449797497581252,
-    0.04928451699227458,
-    0.11807162656393803,
-    0.19941115896256947,
-    0.23746944501081074,
-    0.19941115896256947,
-    0.11807162656393803,
-    0.04928451699227458,
-    0.01449797497581252,
-]
-
-
-@ti.kernel
-def rmse(a: ti.template(), b: ti.template()) -> ti.f32:
-    assert a.shape == b.shape
-    acc: ti.f32 = 0
-    for i, j in a:
-        v = a[i, j] - b[i, j]
-        acc += (v * v).sum()
-    return ti.sqrt(acc / a.shape[0] / a.shape[1])
-
-
-@ti.kernel
-def sum_difference(a: ti.template(), b: ti.template()) -> ti.i32:
-    assert a.shape == b.shape
-    acc: ti.i32 = 0
-    for i, j in a:
-        for k in ti.static(range(3)):
-            v: ti.i32 = a[i, j][k] - b[i, j][k]
-            acc += ti.abs(v)
-    return acc
-
-
-@ti.kernel
-def pixel_count(a: ti.template(), b: ti.template()) -> ti.i32:
-    assert a.shape == b.shape
-    acc: ti.i32 = 0
-    for i, j in a:
-        if any(a[i, j] != b[i, j]):
-            acc += 1
-    return acc
-
-
-@ti.kernel
-def gaussian_blur(a: ti.template(), aux: ti.template()):
-    assert a.shape == aux.shape
-    for i, j in a:
-        acc = ti.Vector([0.0, 0.0, 0.0])
-        for k in ti.static(range(-4, 5)):
-            acc += GAUSSIAN_COEFF[k + 4] * a[i, j+k]
-        aux[i, j] = ti.cast(acc, ti.i16)
-
-    for i, j in a:
-        acc = ti.Vector([0.0, 0.0, 0.0])
-        for k in ti.static(range(-4, 5)):
-            acc += GAUSSIAN_COEFF[k + 4] * aux[i+k, j]
-        a[i, j] = ti.cast(acc, ti.i16)
-
-
-@ti.kernel
-def naive_downscale(img: ti.types.ndarray(dtype=ti.math.vec4), downscaled: ti.types.ndarray(dtype=ti.math.vec4)):
-    for i, j in downscaled:
-        acc = ti.Vector([0.0, 0.0, 0.0, 0.0])
-        for k in ti.static(range(2)):
-            for l in ti.static(range(2)):
-                acc += img[i * 2 + k, j * 2 + l]
-        downscaled[i, j] = ti.cast(acc / 4, ti.u8)
+# Actions run with the example's directory as working directory
+WORK_DIR = Path(os.getcwd())
+
+COMPARE_POOL = None
+TRUTHS = None
+PENDING_COMPARES = []
 
 
 ismodule = lambda obj, name: isinstance(obj, types.ModuleType) and obj.__name__ == name
@@ -123,6 +54,78 @@ def capture(gui, path):
         cv2.imwrite.orig(str(path), cv2._imshow_image)
 
 
+def to_imread_layout(img):
+    # (h, w, c) top to bottom -> (w, h, c) bottom to top, like `ti.tools.imread`
+    return np.ascontiguousarray(img.swapaxes(0, 1)[:, ::-1, :])
+
+
+def grab(gui):
+    """
+    Read current frame straight from memory, as an uint8 array with the
+    same layout `ti.tools.imread` gives. Returns None if not possible,
+    caller should fall back to `capture`.
+    """
+    if gui is None:
+        return None
+
+    if isinstance(gui, ti.ui.Window):
+        if not hasattr(gui, 'get_image_buffer_as_numpy'):
+            return None
+        # Converted from the u8 swapchain image, round() recovers it exactly
+        img = gui.get_image_buffer_as_numpy()
+        return np.round(np.clip(img, 0, 1) * 255).astype(np.uint8)
+    elif isinstance(gui, ti.GUI):
+        img = gui.get_image()
+        if img.dtype != np.float32:
+            return None  # fast_gui
+        # Same conversion as `gui.core.screenshot`
+        return (np.clip(img, 0, 1) * 255).astype(np.uint8)
+    elif ismodule(gui, 'matplotlib.pyplot'):
+        import matplotlib.pyplot as plt
+        fig = plt.gcf()
+        fig.canvas.draw()
+        img = np.asarray(fig.canvas.buffer_rgba())
+        plt.close()
+        return to_imread_layout(img)
+    elif ismodule(gui, 'cv2'):
+        import cv2
+        img = cv2._imshow_image
+        if img.dtype != np.uint8:
+            return None
+        if img.ndim == 2:
+            img = np.stack([img] * 3, axis=-1)
+        elif img.shape[2] == 3:
+            img = img[:, :, ::-1]  # BGR
+        elif img.shape[2] == 4:
+            img = img[:, :, [2, 1, 0, 3]]  # BGRA
+        else:
+            return None
+        return to_imread_layout(img)
+
+    return None
+
+
+def capture_array(gui):
+    img = grab(gui)
+    if img is not None:
+        return img
+
+    # No direct access for this kind of window, round trip through PNG
+    td = tempfile.mkdtemp()
+    try:
+        capture(gui, Path(td) / 'capture.png')
+        return ti.tools.imread(str(Path(td) / 'capture.png'))
+    finally:
+        shutil.rmtree(td, ignore_errors=True)
+
+
+def truths():
+    global TRUTHS
+    if TRUTHS is None:
+        TRUTHS = TruthStore(WORK_DIR / options.truth_cache_dir)
+    return TRUTHS
+
+
 @register('__reset:matplotlib')
 def reset_matplotlib():
     try:
@@ -133,7 +136,7 @@ def reset_matplotlib():
 
 
 @register('capture-and-compare')
-def capture_and_compare(dry, gui, compare, ground_truth, threshold):
+def capture_and_compare(dry, gui, compare, ground_truth, threshold, result, level=1):
     if dry:
         return
 
@@ -141,62 +144,98 @@ def capture_and_compare(dry, gui, compare, ground_truth, threshold):
     if options.generate_captures:
         truth_path.parent.mkdir(parents=True, exist_ok=True)
         logging.getLogger('capture').info(f'Generating {truth_path}')
-        capture(gui, truth_path)
+        img = grab(gui)
+        if img is not None:
+            ti.tools.imwrite(img, str(truth_path))
+            truths().put(truth_path, img)
+            if compare == 'blur-sum-difference':
+                truths().tiles(truth_path, img)
+        else:
+            capture(gui, truth_path)
+        return
+
+    with trace.span('grab', 'capture'):
+        raw = capture_array(gui)
+
+    if not options.async_compare:
+        compare_capture(raw, truth_path, compare, ground_truth, threshold, result, level)
         return
 
-    td = Path(tempfile.mkdtemp())
-    capture(gui, td / 'capture.png')
+    global COMPARE_POOL
+    if COMPARE_POOL is None:
+        COMPARE_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix='compare')
+
+    PENDING_COMPARES.append(
+        COMPARE_POOL.submit(compare_capture, raw, truth_path, compare, ground_truth, threshold, result, level)
+    )
+
+
+@register('__finalize:capture')
+def join_compares():
+    # A test only passes after all its captures are compared
+    try:
+        for fut in PENDING_COMPARES:
+            fut.result()
+    finally:
+        PENDING_COMPARES.clear()
+
+
+@register('__reset:capture')
+def reset_compares():
+    for fut in PENDING_COMPARES:
+        fut.cancel()
+    PENDING_COMPARES.clear()
+
+
+def compare_capture(raw, truth_path, compare, ground_truth, threshold, result, level):
+    # Runs in compare threads with --async-compare, spans show up on their own tracks
+    with trace.span('compare', 'capture', ground_truth=ground_truth, compare=compare):
+        _compare_capture(raw, truth_path, compare, ground_truth, threshold, result, level)
+
+
+def _compare_capture(raw, truth_path, compare, ground_truth, threshold, result, level):
+    captured = raw
 
     def save_bad_compare():
-        save_dir = Path(options.save_compare_dir)
+        save_dir = WORK_DIR / options.save_compare_dir
         save_dir.mkdir(parents=True, exist_ok=True)
         basename, extname = truth_path.name.rsplit('.', 1)
         shutil.copy(truth_path, save_dir / f'{basename}.truth.{extname}')
-        shutil.move(str(td / 'capture.png'), save_dir / f'{basename}.capture.png')
-        shutil.rmtree(td, ignore_errors=True)
+        ti.tools.imwrite(raw, str(save_dir / f'{basename}.capture.png'))
 
-    captured = ti.tools.imread(str(td / 'capture.png'))
-    truth = ti.tools.imread(str(truth_path))
+    truth = truths().load(truth_path)
     if list(captured.shape[:2]) == [i * 2 for i in truth.shape[:2]]:
         # retina, downscale first
-        captured = np.ascontiguousarray(captured)
-        downscaled = np.ascontiguousarray(np.zeros_like(truth))
-        naive_downscale(captured, downscaled)
-        captured = downscaled
-    elif captured.shape != truth.shape:
+        captured = imgdiff.naive_downscale(captured)
+    elif captured.shape[:2] != truth.shape[:2]:
         save_bad_compare()
         raise Failed('capture-and-compare shape mismatch!')
 
-    f_captured = ti.Vector.field(3, dtype=ti.i16, shape=captured.shape[:2])
-    f_truth = ti.Vector.field(3, dtype=ti.i16, shape=truth.shape[:2])
-    f_captured.from_numpy(np.ascontiguousarray(captured[:, :, :3]))
-    f_truth.from_numpy(np.ascontiguousarray(truth[:, :, :3]))
-
-    pixels = f_captured.shape[0] * f_captured.shape[1]
+    pixels = captured.shape[0] * captured.shape[1]
     if compare == 'rmse':
-        diff = rmse(f_captured, f_truth)
         if isinstance(threshold, str) and threshold.endswith('%'):
             threshold = float(threshold[:-1]) / 100 * 255
-    elif compare == 'sum-difference':
-        diff = sum_difference(f_captured, f_truth)
-        if isinstance(threshold, str) and threshold.endswith('%'):
-            threshold = float(threshold[:-1]) / 100 * pixels * 3 * 255
-    elif compare == 'blur-sum-difference':
-        f_aux = ti.Vector.field(3, dtype=ti.i16, shape=truth.shape[:2])
-        gaussian_blur(f_captured, f_aux)
-        gaussian_blur(f_truth, f_aux)
-        diff = sum_difference(f_captured, f_truth)
+    elif compare in ('sum-difference', 'blur-sum-difference', 'pyramid-sum-difference'):
         if isinstance(threshold, str) and threshold.endswith('%'):
             threshold = float(threshold[:-1]) / 100 * pixels * 3 * 255
     elif compare == 'pixel-count':
-        diff = pixel_count(f_captured, f_truth)
         if isinstance(threshold, str) and threshold.endswith('%'):
             threshold = float(threshold[:-1]) / 100 * pixels
     else:
         raise ValueError(f'Unknown compare method: {compare}')
 
+    b_tiles = truths().tiles(truth_path, truth) if compare == 'blur-sum-difference' else None
+    diff, exact = imgdiff.compare(compare, captured, truth, threshold, level, b_tiles)
+
+    result['captures'].append({
+        'ground_truth': ground_truth,
+        'compare': compare,
+        'diff': float(diff),
+        'exact': exact,
+        'threshold': float(threshold),
+    })
+
     if diff > threshold:
         save_bad_compare()
+        diff = diff if exact else f'>{diff}'
         raise Failed(f'capture-and-compare failed! diff({diff}) > threshold({threshold})')
-
-    shutil.rmtree(td, ignore_errors=True)
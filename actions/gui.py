@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 # -- stdlib --
+from collections import deque
 from dataclasses import dataclass
 from enum import Enum
 
@@ -9,11 +10,14 @@ import taichi as ti
 
 # -- own --
 from .common import register
+from args import options, parser
 from utils.misc import hook
 
 
 # -- code --
-NEXT_EVENTS = []
+parser.add_argument('--coalesce-moves', action='store_true', help='Fold consecutive move events of the same frame into one')
+
+NEXT_EVENTS = deque()
 PRESSED_KEYS = set()
 LAST_POS = (0.0, 0.0)
 
@@ -29,6 +33,7 @@ class CookedEvent:
     tag: EventTag
     key: str
     modifiers: list
+    frame: int = None  # delivered in
 
 
 def hook_gui_events():
@@ -44,7 +49,7 @@ def hook_gui_events():
             orig(self)  # discard result
 
         if NEXT_EVENTS:
-            e = NEXT_EVENTS.pop(0)
+            e = NEXT_EVENTS.popleft()
             ev = ti.GUI.Event()
             ev.type = EV_MAP[e.tag]
             ev.key = e.key
@@ -111,7 +116,7 @@ def hook_ggui_events():
         if not NEXT_EVENTS:
             return False
 
-        e = NEXT_EVENTS.pop(0)
+        e = NEXT_EVENTS.popleft()
 
         if e.tag == EventTag.MOTION:
             return False
@@ -130,13 +135,10 @@ def hook_ggui_events():
     @hook(ti.ui.Window)
     def get_events(orig, self, tag=None):
         orig(self, tag)
-        rst = []
-        for e in NEXT_EVENTS:
-            if e.tag == EventTag.MOTION:
-                continue
-            if tag is None or tag == EV_MAP[e.tag]:
-                rst.append(mocked_event(e.key))
-
+        rst = [
+            mocked_event(e.key) for e in NEXT_EVENTS
+            if e.tag != EventTag.MOTION and (tag is None or tag == EV_MAP[e.tag])
+        ]
         NEXT_EVENTS.clear()
         return rst
 
@@ -148,7 +150,7 @@ hook_ggui_events()
 @register('__reset:gui_events')
 def reset():
     global LAST_POS
-    NEXT_EVENTS[:] = []
+    NEXT_EVENTS.clear()
     PRESSED_KEYS.clear()
     LAST_POS = (0.0, 0.0)
 
@@ -199,7 +201,7 @@ def key_press(dry, key, modifiers=[]):
 
 
 @register('move')
-def move(dry, position):
+def move(dry, gui, position):
     global LAST_POS
 
     assert len(position) == 2
@@ -212,11 +214,22 @@ def move(dry, position):
         return
 
     LAST_POS = position
+    frame = getattr(gui, 'frame', None)
+
+    # Events report LAST_POS when they are consumed, so a run of motions
+    # delivered in the same frame is indistinguishable from the last one alone.
+    # Pending ones of earlier frames are left alone, the example just hasn't
+    # got to them yet.
+    if options.coalesce_moves and frame is not None and NEXT_EVENTS:
+        last = NEXT_EVENTS[-1]
+        if last.tag == EventTag.MOTION and last.frame == frame:
+            return
 
     NEXT_EVENTS.append(
         CookedEvent(
             tag=EventTag.MOTION,
             key=ti.GUI.MOVE,
             modifiers=[],
+            frame=frame,
         )
     )
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+# -- stdlib --
+# -- third party --
+import numpy as np
+
+# -- own --
+from .common import register
+from exceptions import Failed
+
+
+# -- code --
+MEASURES = {}  # name -> frame times (s)
+OPEN = set()   # names currently measuring
+
+
+@register('__reset:perf')
+def reset():
+    MEASURES.clear()
+    OPEN.clear()
+
+
+@register('__frame:perf')
+def frame(duration):
+    for name in OPEN:
+        MEASURES[name].append(duration)
+
+
+@register('measure-start')
+def measure_start(dry, name='default'):
+    if dry:
+        return
+
+    MEASURES[name] = []
+    OPEN.add(name)
+
+
+@register('measure-stop')
+def measure_stop(dry, result, name='default'):
+    if dry:
+        return
+
+    if name not in OPEN:
+        raise ValueError(f'measure-stop: measurement `{name}` was not started')
+
+    OPEN.discard(name)
+    times = np.array(MEASURES[name], dtype=np.float64)
+    m = {'frames': len(times)}
+    if len(times):
+        m.update({
+            'fps': float(len(times) / times.sum()),
+            'median': float(np.median(times)),
+            'p95': float(np.percentile(times, 95)),
+            'max': float(times.max()),
+        })
+    result.setdefault('measures', {})[name] = m
+
+
+@register('assert-fps')
+def assert_fps(dry, result, name='default', min_fps=None, max_frame_time=None):
+    assert min_fps is not None or max_frame_time is not None, 'assert-fps: needs min_fps and/or max_frame_time'
+
+    if dry:
+        return
+
+    m = result.get('measures', {}).get(name)
+    if m is None:
+        raise ValueError(f'assert-fps: measurement `{name}` was not stopped (measure-stop) yet')
+    if not m['frames']:
+        raise Failed(f'assert-fps: no frames in measurement `{name}`')
+
+    if min_fps is not None and m['fps'] < min_fps:
+        raise Failed(f'assert-fps: `{name}` ran at {m["fps"]:.1f} fps < {min_fps}')
+
+    # In ms, against the 95th percentile, a single hiccup is not a failure
+    if max_frame_time is not None and m['p95'] * 1000 > max_frame_time:
+        raise Failed(f'assert-fps: `{name}` p95 frame time {m["p95"] * 1000:.2f}ms > {max_frame_time}ms')
@@ -1,19 +1,29 @@
 # -*- coding: utf-8 -*-
 
 # -- stdlib --
+from pathlib import Path
+import logging
 import sys
 
 # -- third party --
+import numpy as np
+
 # -- own --
+from .capture import WORK_DIR
 from .common import register
-from pathlib import Path
+from args import options
+from exceptions import Failed
 
 
 # -- code --
-@register('poke')
-def poke(function, code, current_test):
-    path = Path(current_test['path']).resolve()
-    f = sys._getframe(1)
+def find_frame(function, current_test):
+    """
+    Innermost python frame of `function` defined in the test's script,
+    searching from the caller of the action up. None if not on the stack.
+    """
+    # Test paths are relative to where the runner started, not the example
+    path = (WORK_DIR / current_test['path']).resolve()
+    f = sys._getframe(2)
     while f:
         co = f.f_code
 
@@ -22,9 +32,93 @@ def poke(function, code, current_test):
             continue
 
         if co.co_name == function:
-            exec(code, f.f_globals, f.f_locals)
-            return
+            return f
 
         f = f.f_back
 
-    raise ValueError(f'poke: Cannot find function `{function}`')
+    return None
+
+
+@register('poke')
+def poke(function, code, current_test):
+    f = find_frame(function, current_test)
+    if f is None:
+        raise ValueError(f'poke: Cannot find function `{function}`')
+
+    exec(code, f.f_globals, f.f_locals)
+
+
+def load_field(path):
+    if path.suffix == '.npz':
+        with np.load(path) as f:
+            return f['value']
+    return np.load(path)
+
+
+def save_field(path, value):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix == '.npz':
+        np.savez_compressed(path, value=value)
+    else:
+        np.save(path, value)
+
+
+@register('field-compare')
+def field_compare(dry, function, expr, ground_truth, current_test, result, atol=1e-8, rtol=1e-5):
+    assert Path(ground_truth).suffix in ('.npy', '.npz'), 'field-compare: ground_truth should be a .npy or .npz file'
+
+    if dry:
+        return
+
+    f = find_frame(function, current_test)
+    if f is None:
+        raise ValueError(f'field-compare: Cannot find function `{function}`')
+
+    value = np.asarray(eval(expr, f.f_globals, f.f_locals))
+    truth_path = Path(ground_truth)
+
+    if options.generate_captures:
+        logging.getLogger('capture').info(f'Generating {truth_path}')
+        save_field(truth_path, value)
+        return
+
+    def save_bad_compare():
+        save_dir = WORK_DIR / options.save_compare_dir
+        save_dir.mkdir(parents=True, exist_ok=True)
+        basename = truth_path.name.rsplit('.', 1)[0]
+        save_field(save_dir / f'{basename}.truth{truth_path.suffix}', truth)
+        save_field(save_dir / f'{basename}.capture{truth_path.suffix}', value)
+
+    truth = load_field(truth_path)
+    if value.shape != truth.shape:
+        save_bad_compare()
+        raise Failed(f'field-compare shape mismatch! {value.shape} != {truth.shape}')
+
+    a = value.astype(np.float64)
+    b = truth.astype(np.float64)
+    close = np.isclose(a, b, rtol=rtol, atol=atol, equal_nan=True)
+    err = np.abs(a - b)
+    err[close] = 0  # Matching NaNs & infs
+    nz = b != 0
+    stats = {
+        'mismatched': int(close.size - np.count_nonzero(close)),
+        'max_abs': float(err.max()) if err.size else 0.0,
+        'mean_abs': float(err.mean()) if err.size else 0.0,
+        'max_rel': float((err[nz] / np.abs(b[nz])).max()) if np.any(nz) else 0.0,
+    }
+
+    result['captures'].append({
+        'ground_truth': ground_truth,
+        'compare': 'field-compare',
+        'diff': float(stats['mismatched']),
+        'threshold': 0.0,
+        'stats': stats,
+    })
+
+    if stats['mismatched']:
+        save_bad_compare()
+        raise Failed(
+            f'field-compare failed! {stats["mismatched"]}/{close.size} elements off '
+            f'(max abs {stats["max_abs"]:.3g}, mean abs {stats["mean_abs"]:.3g}, max rel {stats["max_rel"]:.3g}), '
+            f'atol={atol} rtol={rtol}'
+        )
@@ -5,6 +5,7 @@ import argparse
 
 # -- third party --
 # -- own --
+from utils.shard import parse_shard
 
 # -- code --
 class OptionsProxy(object):
@@ -19,10 +20,52 @@ options = OptionsProxy()
 
 
 parser = argparse.ArgumentParser('taichi-release-tests-runner')
-parser.add_argument('timelines')
+parser.add_argument('timelines', nargs='?')
 parser.add_argument('--log', default='INFO')
 parser.add_argument('--runners', type=int, default=1)
-parser.add_argument('--use-stale-offline-cache', action='store_true')
+parser.add_argument('--isolate', action='store_true', help='Run tests in worker processes even with --runners 1')
+parser.add_argument('--tests-per-worker', type=int, default=1, help='Tests a worker process runs before it is replaced')
+parser.add_argument('--worker-max-rss', type=int, help='In MB, replace a worker process once its RSS grows over this, implies --isolate')
+parser.add_argument('--test-timeout', type=float, help='In seconds, kill tests running longer and fail them, implies --isolate')
+parser.add_argument(
+    '--no-cpu-partition', dest='cpu_partition', action='store_false',
+    help='With --runners, do not split cpus between runners (affinity, taichi & BLAS/OpenMP thread counts)',
+)
+parser.add_argument(
+    '--offline-cache', choices=['fresh', 'stale', 'managed'], default='fresh',
+    help='fresh: empty cache for every test, stale: whatever taichi is configured with, '
+         'managed: shared cache keyed by taichi build and arch',
+)
+parser.add_argument('--use-stale-offline-cache', dest='offline_cache', action='store_const', const='stale')
+parser.add_argument('--offline-cache-dir', default='.release-tests/offline-cache')
+parser.add_argument('--offline-cache-size', type=int, default=4096, help='In MB, for managed offline cache')
+parser.add_argument('--warm-offline-cache', action='store_true', help='Compile every test before running with managed offline cache')
+parser.add_argument('--memory-limit', type=int, help='In MB, memory tests running in parallel may use together, default 80%% of RAM')
+parser.add_argument('--history-file', default='.release-tests/history.json')
+parser.add_argument('--results-db', default='.release-tests/results.db')
+parser.add_argument('--green-file', default='.release-tests/green.json')
+parser.add_argument('--timeline-cache-dir', default='.release-tests/timelines')
+parser.add_argument('--since-last-green', action='store_true', help='Skip tests unchanged since they last passed')
+parser.add_argument('--shard', type=parse_shard, help='K/N, only run the K-th of N balanced shards')
+parser.add_argument(
+    '--shard-estimates', metavar='HISTORY_FILE',
+    help='Balance --shard by durations in this history file, every shard must get the same (unchanging) one',
+)
+parser.add_argument('--results-json', help='Write results of this run to a JSON file')
+parser.add_argument('--trace-dir', help='Write a Chrome trace of every test (frames, steps, captures, first compile) here')
+parser.add_argument('--kernel-stats', action='store_true', help='Report JIT vs run time of every kernel')
+parser.add_argument('--kernel-profiler', action='store_true', help='Like --kernel-stats, plus device time from taichi kernel profiler')
+parser.add_argument('--merge-traces', action='store_true', help='Also merge traces of all tests into one timeline, <trace-dir>/merged.json')
+parser.add_argument('--fast-forward', action='store_true', help='Do not render & present frames without a capture (ti.GUI, ti.ui.Window & cv2)')
+parser.add_argument('--headless', action='store_true', help='Never open windows, and ignore fps limits & vsync')
+parser.add_argument('--benchmark', action='store_true', help='Run every test --warmup + --repeat times and report frame times')
+parser.add_argument('--warmup', type=int, default=1, help='Benchmark runs thrown away before measuring')
+parser.add_argument('--repeat', type=int, default=3, help='Measured benchmark runs')
+parser.add_argument('--baseline', help='Benchmark baseline JSON to compare with')
+parser.add_argument('--update-baseline', action='store_true', help='Write benchmark results to --baseline instead of comparing')
+parser.add_argument('--tolerance', type=float, default=10, help='In percent, slowdown against baseline tolerated by --benchmark')
+parser.add_argument('--serve', metavar='HOST:PORT', help='Hand out tests to workers instead of running them')
+parser.add_argument('--connect', metavar='HOST:PORT', help='Run as a worker of the coordinator at HOST:PORT')
 
 
 def parse_args():
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+# -- stdlib --
+from collections import Counter
+import argparse
+import json
+
+# -- third party --
+# -- own --
+
+
+# -- code --
+def coverage(shards, results):
+    """
+    Problems with how shards covered the suite: every test assigned to
+    exactly one shard, and run (reported exactly once) or skipped by it.
+    """
+    problems = []
+
+    suites = {s.get('suite') for s in shards}
+    if len(suites) > 1:
+        problems.append(f'shards ran different suites ({len(suites)} distinct), different checkouts or timeline paths?')
+
+    names = [s.get('shard') for s in shards if s.get('shard')]
+    counts = {int(n.split('/')[1]) for n in names}
+    if len(counts) > 1:
+        problems.append(f'shards of different shard counts: {sorted(names)}')
+    elif counts:
+        n, = counts
+        got = Counter(int(s.split('/')[0]) for s in names)
+        missing = [k for k in range(1, n + 1) if not got[k]]
+        if missing:
+            problems.append(f'missing shards: {", ".join(f"{k}/{n}" for k in missing)}')
+        dup = [k for k, c in got.items() if c > 1]
+        if dup:
+            problems.append(f'shards merged more than once: {", ".join(f"{k}/{n}" for k in dup)}')
+
+    assigned = Counter(t for s in shards for t in s['assigned'])
+    skipped = {t for s in shards for t in s['skipped']}
+    reported = Counter(r['id'] for r in results)
+    for t, c in sorted(assigned.items()):
+        if c > 1:
+            problems.append(f'{t}: assigned to {c} shards')
+        if t in skipped:
+            continue
+        if not reported[t]:
+            problems.append(f'{t}: did not report')
+        elif reported[t] > 1:
+            problems.append(f'{t}: reported {reported[t]} times')
+    for t in sorted(set(reported) - set(assigned)):
+        problems.append(f'{t}: reported but not assigned to any shard')
+
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser('merge_results')
+    parser.add_argument('output', help='Merged result file')
+    parser.add_argument('inputs', nargs='+', help='Result files written by `run.py --results-json`')
+    options = parser.parse_args()
+
+    merged = {'shards': [], 'results': []}
+    for fn in options.inputs:
+        with open(fn) as f:
+            part = json.load(f)
+        if 'results' not in part:
+            parser.error(f'{fn} has no test results, benchmark results (--benchmark) can not be merged')
+        merged['shards'].append({k: v for k, v in part.items() if k != 'results'})
+        merged['results'].extend(part['results'])
+
+    problems = coverage(merged['shards'], merged['results'])
+    merged['problems'] = problems
+
+    with open(options.output, 'w') as f:
+        json.dump(merged, f, indent=1)
+
+    for shard in merged['shards']:
+        print(f"shard {shard.get('shard') or '-':>6}  {shard['host']:20}  {shard['duration']:8.1f}s  {shard['taichi_version']}")
+
+    failed = [r for r in merged['results'] if r['status'] != 'passed']
+    skipped = sum(len(s['skipped']) for s in merged['shards'])
+    print(f"{len(merged['results'])} tests, {len(failed)} failed, {skipped} skipped")
+    for r in failed:
+        print(f"FAILED  {r['id']}  {r['error']}")
+
+    for p in problems:
+        print(f'COVERAGE: {p}')
+
+    if failed or problems:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,28 +6,41 @@ os.environ['TI_GUI_FAST'] = '0'
 os.environ['MPLBACKEND'] = 'agg'
 
 # -- stdlib --
-from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
+import hashlib
 import importlib
 import importlib.util
+import inspect
+import json
 import logging
 import platform
 import random
 import sys
 import tempfile
+import time
 
 # -- third party --
 import numpy as np
 import taichi as ti
-import yaml
 
 # -- own --
 from actions import ACTIONS
 from actions.common import register
-from args import options, parse_args
+from args import options, parse_args, parser
 from exceptions import Success
-from utils import logconfig
+from utils import bench, cpuslots, logconfig, trace
+from utils.dispatch import Coordinator, WorkerClient, parse_address
+from utils.fingerprint import Fingerprinter, GreenRecord
+from utils.forkpool import make_pool
+from utils.history import History, test_id, test_key
+from utils.kernelstats import KernelStats, format_table
+from utils.memory import MemoryProbe, physical_memory
 from utils.misc import hook
+from utils.offline_cache import OfflineCache, arch_key
+from utils.resultdb import ResultDB
+from utils.shard import partition
+from utils.timeline import TimelineCache, compile_steps, resolve_steps
 
 
 # -- code --
@@ -38,9 +51,18 @@ STATE = {
     'current_test': None,
     'current_module': None,
     'ensure_compiled_run': False,
-    'steps_iter': None,
+    'steps': [],
+    'step_index': -1,
     'step': None,
-    'last_step_frame': 0,
+    'result': None,
+    'offline_cache': None,
+    'captured': False,
+    'skip_render': False,
+    'frame_started': 0,
+    'kernel_stats': None,
+    'frame_times': None,
+    'frame_handlers': [],
+    'cpu_threads': None,
 }
 
 ACTIVE_GUI = set()
@@ -50,76 +72,190 @@ apply = lambda f, *a, **k: f(*a, **k)
 
 
 def next_step():
-    assert STATE['steps_iter']
-    try:
-        STATE['step'] = next(STATE['steps_iter'])
-    except StopIteration:
+    STATE['step_index'] += 1
+    if STATE['step_index'] >= len(STATE['steps']):
         STATE['step'] = None
         raise Success
 
+    STATE['step'] = STATE['steps'][STATE['step_index']]
 
-def run_step(gui, test, step, dry=False):
-    if 'action' not in step:
-        raise ValueError('Step %s has no action!', step)
-    if step['action'] not in ACTIONS:
-        raise ValueError('Unknown action %s!', step['action'])
 
-    action = ACTIONS[step['action']]
-    args = {**step, 'dry': dry, 'gui': gui, 'current_test': test}
-    args = {k: v for k, v in args.items() if k in action.params}
+def capture_pending(frame):
+    # Whether `show` of `frame` will run a capture, see `try_run_step`
+    for step in STATE['steps'][STATE['step_index']:]:
+        if step.frame > frame:
+            return False
+        if step.action == 'capture-and-compare':
+            return True
 
-    if dry and 'dry' not in args:
-        return
+    return False
+
+
+def run_step(gui, test, step):
+    # Steps are compiled (see utils/timeline.py), only runtime arguments are left to fill in
+    runtime = {'dry': False, 'gui': gui, 'current_test': test, 'result': STATE['result']}
+    args = dict(step.kwargs)
+    for k in step.runtime:
+        args[k] = runtime[k]
+
+    if step.action == 'capture-and-compare':
+        STATE['captured'] = True
 
+    cat = 'capture' if step.action == 'capture-and-compare' else 'step'
+    b4 = time.time()
     try:
-        orig = os.getcwd()
-        os.chdir(STATE['orig_work_dir'])
-        action(**args)
+        with trace.span(step.action, cat, frame=getattr(gui, 'frame', None)):
+            step.func(**args)
     finally:
-        os.chdir(orig)
+        STATE['result']['steps'].append({
+            'action': step.action,
+            'frame': getattr(gui, 'frame', None),
+            'duration': time.time() - b4,
+        })
 
 
 def try_run_step(self):
     test = STATE['current_test']
     step = STATE['step']
-    if step is None:
+    if step is None or self.frame < step.frame:
         return False
 
-    fr = step['frame']
-    if isinstance(fr, str) and fr.startswith('@'):
-        fr = int(fr[1:])
-    else:
-        fr = STATE['last_step_frame'] + int(fr)
-
-    if self.frame < fr:
-        return False
-
-    STATE['last_step_frame'] = self.frame
     run_step(self, test, step)
     next_step()
     return True
 
 
+@contextmanager
+def frame_span(gui):
+    # A frame lasts from the previous `show` returning till this one returns
+    frame = gui.frame
+    try:
+        yield
+    finally:
+        t = trace.now()
+        if trace.ACTIVE:
+            trace.ACTIVE.complete(f'frame {frame}', 'frame', STATE['frame_started'], t)
+        dt = (t - STATE['frame_started']) / 1e6
+        if STATE['frame_times'] is not None:
+            STATE['frame_times'].append(dt)
+        for handler in STATE['frame_handlers']:
+            handler(dt)
+        STATE['frame_started'] = t
+
+
 @hook(ti.GUI, 'show')
 def gui_show(orig, self, _=None):
     ACTIVE_GUI.add(self)
-    while try_run_step(self):
-        pass
-    orig(self)
+    STATE['captured'] = False
+    with frame_span(self):
+        while try_run_step(self):
+            pass
+
+        if options.fast_forward and not STATE['captured']:
+            # Captures read the canvas, not the window. Skip presenting (and
+            # fps limiting), but keep what `show` does to the GUI state.
+            self.frame += 1
+            self.clear()
+            return
+
+        with trace.span('present', 'present'):
+            orig(self)
 
 
 @hook(ti.ui.Window, 'show')
 def ggui_show(orig, self, _=None):
     ACTIVE_GGUI.add(self)
-    while try_run_step(self):
-        pass
-    orig(self)
-    self.frame += 1
+    with frame_span(self):
+        while try_run_step(self):
+            pass
+
+        if STATE['skip_render']:
+            # Nothing was drawn (see `hook_ggui_drawing`), nothing to render or present
+            self.frame += 1
+        else:
+            with trace.span('present', 'present'):
+                orig(self)
+            self.frame += 1
+
+    STATE['skip_render'] = options.fast_forward and not capture_pending(self.frame)
 
 
 ti.ui.Window.frame = 0
 
 
+@apply
+def hook_ggui_drawing():
+    # `ti.ui.Window.show` renders and presents whatever was drawn since the
+    # last one, and then starts over. When fast forwarding past frames
+    # without a capture it's skipped, so drawing must be skipped too, or it
+    # piles up till the next frame that is rendered.
+    def skip(cls, name, rv=lambda orig, *a, **k: None):
+        if cls is None or not hasattr(cls, name):
+            return
+
+        @hook(cls, name)
+        def skipper(orig, *args, **kwargs):
+            if STATE['skip_render']:
+                return rv(orig, *args, **kwargs)
+            return orig(*args, **kwargs)
+
+    for name in ('set_image', 'contour', 'triangles', 'lines', 'circles', 'vector_field', 'scene'):
+        skip(ti.ui.Canvas, name)
+
+    scene_v2 = getattr(sys.modules.get('taichi.ui.scene'), 'SceneV2', None)
+    for cls in (ti.ui.Scene, scene_v2):
+        for name in ('lines', 'mesh', 'mesh_instance', 'particles', 'point_light', 'ambient_light'):
+            skip(cls, name)
+
+    # Widgets return what they would without user input
+    def old_value(orig, *args, **kwargs):
+        return inspect.signature(orig).bind(*args, **kwargs).arguments['old_value']
+
+    for name in ('begin', 'end', 'text'):
+        skip(ti.ui.Gui, name)
+    for name in ('checkbox', 'slider_int', 'slider_float', 'color_edit_3'):
+        skip(ti.ui.Gui, name, old_value)
+    skip(ti.ui.Gui, 'button', lambda orig, *a, **k: False)
+
+
+def override_args(orig, args, kwargs, **overrides):
+    # Force some arguments of `orig`, no matter passed positionally or not
+    bound = inspect.signature(orig).bind(*args, **kwargs)
+    bound.arguments.update(overrides)
+    return bound.args, bound.kwargs
+
+
+@hook(ti.GUI, '__init__')
+def gui_init(orig, *args, **kwargs):
+    if options.headless:
+        args, kwargs = override_args(orig, args, kwargs, show_gui=False)
+    orig(*args, **kwargs)
+    if options.headless:
+        args[0].fps_limit = None
+
+
+@apply
+def hook_gui_fps_limit():
+    prop = ti.GUI.fps_limit
+
+    def fset(self, value):
+        prop.fset(self, None if options.headless else value)
+
+    ti.GUI.fps_limit = property(prop.fget, fset, doc=prop.__doc__)
+
+
+# Effectively unlimited
+HEADLESS_GGUI_FPS_LIMIT = 100000
+
+
+@hook(ti.ui.Window, '__init__')
+def ggui_init(orig, *args, **kwargs):
+    if options.headless:
+        args, kwargs = override_args(orig, args, kwargs, show_window=False, vsync=False, fps_limit=HEADLESS_GGUI_FPS_LIMIT)
+    orig(*args, **kwargs)
+    STATE['skip_render'] = options.fast_forward and not capture_pending(args[0].frame)
+
+
 @apply
 def hook_matplotlib():
     try:
@@ -135,7 +271,7 @@ def hook_matplotlib():
         if step is None:
             return
 
-        if not step['action'] == 'capture-and-compare':
+        if not step.action == 'capture-and-compare':
             return
 
         run_step(plt, test, step)
@@ -154,6 +290,8 @@ def hook_opencv():
 
     @hook(cv2)
     def waitKey(orig, *a, **k):
+        if options.fast_forward or options.headless:
+            return -1
         return orig(1)
 
     @hook(cv2)
@@ -162,13 +300,19 @@ def hook_opencv():
 
     @hook(cv2)
     def imshow(orig, winname, mat):
-        orig(winname, mat)
-        cv2._imshow_image = mat
-        while try_run_step(cv2):
-            pass
+        with frame_span(cv2):
+            if not (options.fast_forward or options.headless):
+                with trace.span('present', 'present'):
+                    orig(winname, mat)
+            cv2._imshow_image = mat
+            while try_run_step(cv2):
+                pass
 
     @register('__reset:cv2')
     def reset_cv2():
+        if options.headless:
+            return
+
         try:
             import cv2
             cv2.destroyAllWindows()
@@ -182,6 +326,13 @@ def init(orig, arch=None, **kwargs):
     kwargs['random_seed'] = 23333
     np.random.seed(23333)
     random.seed(23333)
+    if STATE['offline_cache']:
+        kwargs.update(STATE['offline_cache'].init_kwargs(arch_key(arch)))
+    if options.kernel_profiler:
+        kwargs['kernel_profiler'] = True
+    if STATE['cpu_threads']:
+        # One thread per core of the whole machine is taichi's default, keep to our share
+        kwargs['cpu_max_num_threads'] = min(kwargs.get('cpu_max_num_threads', STATE['cpu_threads']), STATE['cpu_threads'])
     return orig(arch=arch, **kwargs)
 
 
@@ -196,25 +347,121 @@ def ensure_compiled(orig, self, *args):
     if 'before_first_kernel' in test:
         exec(test['before_first_kernel'], mod.__dict__, mod.__dict__)
 
-    return orig(self, *args)
+    with trace.span('first kernel compile', 'compile', kernel=self.func.__name__):
+        return orig(self, *args)
+
+
+@hook(ti.lang.kernel_impl.Kernel)
+def materialize(orig, self, *args, **kwargs):
+    stats = STATE['kernel_stats']
+    if stats is None:
+        return orig(self, *args, **kwargs)
+
+    # Returns right away for already materialized instances, only count new ones
+    n = len(self.compiled_kernels)
+    b4 = time.perf_counter()
+    try:
+        return orig(self, *args, **kwargs)
+    finally:
+        if len(self.compiled_kernels) > n:
+            stats.materialized(self.func.__name__, time.perf_counter() - b4)
+
+
+@hook(ti.lang.kernel_impl.Kernel)
+def launch_kernel(orig, self, t_kernel, *args):
+    stats = STATE['kernel_stats']
+    if stats is None:
+        return orig(self, t_kernel, *args)
+
+    first = stats.first_launch(t_kernel)
+    b4 = time.perf_counter()
+    try:
+        return orig(self, t_kernel, *args)
+    finally:
+        stats.launch(self.func.__name__, time.perf_counter() - b4, first)
+
+
+@contextmanager
+def offline_cache_env():
+    mode = options.offline_cache
+    if mode == 'stale':
+        yield
+    elif mode == 'managed':
+        # Actual path is chosen by the `ti.init` hook, depending on arch
+        with STATE['offline_cache'].using():
+            yield
+    else:
+        with tempfile.TemporaryDirectory(prefix='ti-release-tests-offline-cache-') as d:
+            orig = os.environ.get('TI_OFFLINE_CACHE_FILE_PATH')
+            try:
+                os.environ['TI_OFFLINE_CACHE_FILE_PATH'] = d
+                yield
+            finally:
+                if orig is None:
+                    os.environ.pop('TI_OFFLINE_CACHE_FILE_PATH', None)
+                else:
+                    os.environ['TI_OFFLINE_CACHE_FILE_PATH'] = orig
+
+
+def finish_program(test):
+    # Taichi writes compiled kernels to the offline cache when the program is
+    # finalized. Do it before leaving `offline_cache_env`: forked workers exit
+    # without ever finalizing, and a released managed cache may be evicted.
+    stats = STATE['kernel_stats']
+    if stats and options.kernel_profiler:
+        try:
+            stats.device_time = ti.profiler.get_kernel_profiler_total_time()
+        except Exception:
+            log.warning('Cannot query kernel profiler of %s', test['path'], exc_info=True)
+
+    try:
+        for gui in ACTIVE_GUI:
+            gui.close()
+
+        for gui in ACTIVE_GGUI:
+            gui.destroy()
+    finally:
+        ACTIVE_GUI.clear()
+        ACTIVE_GGUI.clear()
+
+    ti.reset()
 
 
 def run(test):
     log.info('Running %s...', test['path'])
-    import time
     b4 = time.time()
     ti.reset()
+    probe = MemoryProbe()
+
+    result = {
+        'test': test_key(test),
+        'id': test_id(test),
+        'status': 'passed',
+        'error': None,
+        'duration': None,
+        'steps': [],
+        'captures': [],
+    }
 
     STATE['ensure_compiled_run'] = False
+    STATE['kernel_stats'] = KernelStats() if options.kernel_stats or options.kernel_profiler else None
+    STATE['frame_times'] = [] if options.benchmark else None
+    STATE['result'] = result
     STATE['current_test'] = test
-    STATE['steps_iter'] = iter(test['steps'])
-    STATE['last_step_frame'] = 0
+    STATE['steps'] = resolve_steps(test['steps'], STATE['orig_work_dir'])
+    STATE['step_index'] = -1
+    STATE['skip_render'] = False
     next_step()
 
+    if options.trace_dir:
+        trace.start(result['test'])
+
     for act in ACTIONS:
         if act.startswith('__reset:'):
             ACTIONS[act]()
 
+    STATE['frame_handlers'] = [ACTIONS[act] for act in ACTIONS if act.startswith('__frame:')]
+
     spec = importlib.util.spec_from_file_location('__main__', Path(test['path']).resolve())
     assert spec
     assert spec.loader
@@ -225,47 +472,76 @@ def run(test):
     os.chdir(wd)
     sys.path.insert(0, str(wd))
     try:
-        if not options.use_stale_offline_cache:
-            with tempfile.TemporaryDirectory(prefix='ti-release-tests-offline-cache-') as d:
+        try:
+            STATE['frame_started'] = trace.now()
+            with offline_cache_env():
                 try:
-                    orig = os.environ.get('TI_OFFLINE_CACHE_FILE_PATH')
-                    os.environ['TI_OFFLINE_CACHE_FILE_PATH'] = d
-                    spec.loader.exec_module(module)
+                    with trace.span(test['path'], 'test'):
+                        spec.loader.exec_module(module)
                 finally:
-                    if orig:
-                        os.environ['TI_OFFLINE_CACHE_FILE_PATH'] = orig
-        else:
-            spec.loader.exec_module(module)
-    except Success:
-        pass
-    except BaseException:
-        log.error("%s failed!", test['path'])
+                    finish_program(test)
+        except Success:
+            pass
+
+        for act in ACTIONS:
+            if act.startswith('__finalize:'):
+                ACTIONS[act]()
+    except KeyboardInterrupt:
         raise
+    except BaseException as e:
+        log.exception("%s failed!", test['path'])
+        result['status'] = 'failed'
+        result['error'] = f'{type(e).__name__}: {e}'
     finally:
         os.chdir(STATE['orig_work_dir'])
         sys.path.remove(str(wd))
 
-    for gui in ACTIVE_GUI:
-        gui.close()
+    if STATE['frame_times'] is not None:
+        result['frame_times'] = STATE['frame_times']
+        STATE['frame_times'] = None
 
-    for gui in ACTIVE_GGUI:
-        gui.destroy()
+    result['memory'] = mem = probe.finish()
+    budget = test.get('memory_budget')
+    if budget and mem['peak_rss'] and mem['peak_rss'] > budget and result['status'] == 'passed':
+        result['status'] = 'failed'
+        result['error'] = f'Failed: peak RSS {mem["peak_rss"] >> 20}MB exceeds memory_budget {budget >> 20}MB'
+        log.error('%s %s', test['path'], result['error'])
 
-    ACTIVE_GUI.clear()
-    ACTIVE_GGUI.clear()
+    stats = STATE['kernel_stats']
+    if stats:
+        result['kernels'] = stats.summary()
+        log.info('KERNELS: %s\n%s', test['path'], format_table(result['kernels']))
+        STATE['kernel_stats'] = None
 
     af = time.time()
     log.info('TIME: %s done in %.2fs', test['path'], af - b4)
+    result['duration'] = af - b4
 
-    return True
+    tracer = trace.stop()
+    if tracer:
+        path = Path(options.trace_dir) / trace.file_name(result['test'])
+        tracer.save(path)
+        result['trace'] = str(path.resolve())
 
+    return result
 
-def collect_timeline(rst, p):
-    log.info('Collecting cases in %s', p)
 
-    with open(p) as f:
-        tests = yaml.safe_load(f)
+def collect_timeline(rst, timeline):
+    log.info('Collecting cases in %s', timeline)
+
+    tests = TimelineCache(options.timeline_cache_dir).load(timeline)
+
+    for test in tests:
+        p = Path(test['path'])
+        if not p.exists():
+            log.error('%s does not exist!', p)
+            continue
+        else:
+            test['timeline'] = str(timeline)
+            rst.append(test)
 
+
+def machine_compatible(test):
     machine = platform.machine()
     COALESCE = {
         'AMD64': 'x86_64',
@@ -273,21 +549,84 @@ def collect_timeline(rst, p):
     }
     machine = COALESCE.get(machine, machine)
 
-    for i, test in enumerate(tests):
-        m = test.get('machine', None)
-        if m and machine not in m:
-            log.debug('Skipping %s:%d due to incompatible machine type %s (we are on %s)', test['path'], i, m, machine)
-            continue
+    m = test.get('machine', None)
+    if m and machine not in m:
+        log.debug('Skipping %s due to incompatible machine type %s (we are on %s)', test_id(test), m, machine)
+        return False
 
-        p = Path(test['path'])
-        if not p.exists():
-            log.error('%s does not exist!', p)
-            continue
-        else:
-            for step in test['steps']:
-                run_step(None, test, step, dry=True)
+    return True
 
-            rst.append(test)
+
+def run_all(tests, history=None):
+    # Timeouts & RSS limits need tests in worker processes
+    isolate = options.isolate or options.test_timeout or options.worker_max_rss
+    if options.runners == 1 and not isolate:
+        return map(run, tests)
+
+    cost = budget = None
+    if history:
+        # Don't start memory hungry tests together, peaks seen before
+        # (or declared budgets) of running tests must fit the limit
+        cost = lambda t: history.peak_rss(test_key(t)) or t.get('memory_budget') or 0
+        budget = options.memory_limit << 20 if options.memory_limit else int((physical_memory() or 0) * 0.8)
+
+    # Tests run in children forked from this process, which has
+    # already imported taichi & friends and installed all the hooks.
+    pool = make_pool(
+        options.runners,
+        cost=cost,
+        budget=budget,
+        setup=pin_cpus if options.cpu_partition and options.runners > 1 else None,
+        max_items=options.tests_per_worker,
+        max_rss=options.worker_max_rss << 20 if options.worker_max_rss else None,
+        timeout=options.test_timeout,
+        failed=worker_failed,
+    )
+    return pool.imap_unordered(run, tests)
+
+
+def worker_failed(test, reason, elapsed):
+    # Worker crashed (segfault, OOM kill ...) or timed out, the rest of the suite goes on
+    return {
+        'test': test_key(test),
+        'id': test_id(test),
+        'status': 'failed',
+        'error': f'Worker {reason}',
+        'duration': elapsed,
+        'steps': [],
+        'captures': [],
+    }
+
+
+def pin_cpus(slot):
+    STATE['cpu_threads'] = cpuslots.pin(slot, options.runners)
+
+
+def taichi_build():
+    return '.'.join(map(str, ti.__version__)), ti._lib.core.get_commit_hash()
+
+
+def setup_offline_cache():
+    if options.offline_cache != 'managed':
+        return
+
+    version, commit = taichi_build()
+    STATE['offline_cache'] = OfflineCache(
+        options.offline_cache_dir,
+        f'{version}-{commit[:12]}',
+        options.offline_cache_size * 2**20,
+    )
+
+
+def warm_offline_cache(timelines):
+    # Kernels are mostly compiled before the first frame is shown,
+    # running every test up to there is enough to fill the cache.
+    log.info('Warming up offline cache...')
+    steps = compile_steps([{'frame': 1, 'action': 'succeed'}])
+    warmup = [{**test, 'steps': steps} for test in timelines]
+    for r in run_all(warmup):
+        if r['status'] != 'passed':
+            log.warning('Warming up %s failed, ignored', r['test'])
 
 
 def run_timelines(timeline_path):
@@ -305,22 +644,196 @@ def run_timelines(timeline_path):
         collect_timeline(timelines, p)
     else:
         log.error("Don't know how to run %s", p)
-        return
+        return False
 
-    if options.runners == 1:
-        for test in timelines:
-            run(test)
+    started = time.time()
+    history = History(options.history_file)
+
+    # Identifies the suite, shards of different suites can't be merged
+    suite = hashlib.sha1('\n'.join(sorted(test_id(t) for t in timelines)).encode('utf-8')).hexdigest()
+    if options.shard:
+        # Every host must come up with the same partition: tests not runnable
+        # here are still partitioned, and estimates don't change while
+        # shards run (unlike history, which they write)
+        k, n = options.shard
+        estimates = History(options.shard_estimates).estimate(timelines) if options.shard_estimates else None
+        shards = partition([test_id(t) for t in timelines], estimates, n)
+        timelines = [timelines[i] for i in shards[k - 1]]
+        log.info('Running shard %d/%d, %d tests', k, n, len(timelines))
+
+    assigned = [test_id(t) for t in timelines]
+    skipped = {test_id(t): 'machine' for t in timelines if not machine_compatible(t)}
+    timelines = [t for t in timelines if test_id(t) not in skipped]
+
+    version, commit = taichi_build()
+
+    fingerprint = Fingerprinter(f'{version}-{commit}')
+    fingerprints = {test_id(t): fingerprint(t) for t in timelines}
+    green = GreenRecord(options.green_file)
+    if options.since_last_green:
+        n = len(timelines)
+        skipped.update({test_id(t): 'green' for t in timelines if green.is_green(test_id(t), fingerprints[test_id(t)])})
+        timelines = [t for t in timelines if test_id(t) not in skipped]
+        log.info('Skipping %d unchanged tests that passed last time', n - len(timelines))
+
+    setup_offline_cache()
+    if options.warm_offline_cache:
+        if not STATE['offline_cache']:
+            log.warning('--warm-offline-cache only makes sense with --offline-cache=managed, ignored')
+        elif options.serve:
+            log.warning('--warm-offline-cache is not supported with --serve, ignored')
+        else:
+            warm_offline_cache(timelines)
+
+    def run_info():
+        # Common to result files of normal & benchmark runs
+        return {
+            'shard': '%d/%d' % options.shard if options.shard else None,
+            'host': platform.node(),
+            'taichi_version': version,
+            'taichi_commit': commit,
+            'started': started,
+            'duration': time.time() - started,
+            'tests': len(timelines),
+        }
+
+    if options.benchmark:
+        try:
+            return run_benchmark(timelines, run_info)
+        finally:
+            if STATE['offline_cache']:
+                STATE['offline_cache'].evict()
+
+    db = ResultDB(options.results_db)
+    run_id = db.begin_run(platform.node(), version, commit)
+    results = []
+
+    def report(r):
+        results.append(r)
+        db.add_result(run_id, r)
+        if r['status'] != 'passed':
+            green.update(r['id'], None)
+            return False
+        history.record(r['test'], r['duration'], r.get('memory', {}).get('peak_rss'))
+        green.update(r['id'], fingerprints[r['id']])
+        return True
+
+    if options.runners > 1 or options.serve:
+        # Longest expected first, so a slow test starting late won't
+        # dictate when the whole suite finishes.
+        timelines = history.longest_first(timelines)
+
+    if options.serve:
+        # Workers (`run.py --connect`) pull tests one at a time and report back
+        source = Coordinator(parse_address(options.serve), timelines).serve()
     else:
-        with ProcessPoolExecutor(max_workers=options.runners) as pool:
-            for r in pool.map(run, timelines):
-                if not r:
-                    break
+        source = run_all(timelines, history)
+
+    expected = {test_key(t): history.expected(test_key(t)) for t in timelines}
+    suite_started = time.time()
+    parallel = None
+    try:
+        for r in source:
+            if not report(r):
+                return False
+    finally:
+        if options.runners > 1 and not options.serve and results:
+            parallel = cpuslots.efficiency(results, expected, time.time() - suite_started, options.runners)
+            log.info(
+                'PARALLEL: %d runners, utilization %.0f%%, efficiency %.0f%%%s',
+                options.runners, parallel['utilization'] * 100, parallel['efficiency'] * 100,
+                ', tests %.2fx slower than recorded' % parallel['slowdown'] if parallel['slowdown'] else '',
+            )
+        history.save()
+        green.save()
+        db.close()
+        if options.results_json:
+            with open(options.results_json, 'w') as f:
+                json.dump({
+                    **run_info(),
+                    'suite': suite,
+                    'assigned': assigned,
+                    'skipped': skipped,
+                    'parallel': parallel,
+                    'results': results,
+                }, f, indent=1)
+        if STATE['offline_cache']:
+            STATE['offline_cache'].evict()
+        if options.trace_dir and options.merge_traces:
+            # Traces of remote workers (--serve) live on their hosts, only local ones are merged
+            trace.merge([r['trace'] for r in results if r.get('trace')], Path(options.trace_dir) / 'merged.json')
+
+    return True
+
+
+def run_benchmark(timelines, run_info):
+    if options.runners > 1:
+        log.warning('Tests running in parallel disturb each other, benchmark numbers will be noisy')
+    if not options.headless:
+        log.warning('Without --headless, frame times include vsync & fps limits of the examples')
+
+    # Warmup runs fill OS & offline caches, and are thrown away. Rounds run
+    # one after another, runs of the same test never overlap.
+    runs = {}
+    for i in range(options.warmup + options.repeat):
+        for r in run_all(timelines):
+            if r['status'] != 'passed':
+                log.error('%s failed while benchmarking: %s', r['id'], r['error'])
+                return False
+            if i >= options.warmup:
+                runs.setdefault(r['id'], []).append(r)
+
+    summaries = {test: bench.summarize(rs) for test, rs in runs.items()}
+    baseline = bench.load_baseline(options.baseline) if options.baseline else {}
+    log.info('Benchmark results:\n%s', bench.format_table(summaries, baseline))
+
+    if options.results_json:
+        with open(options.results_json, 'w') as f:
+            json.dump({**run_info(), 'benchmark': summaries}, f, indent=1)
+
+    if options.update_baseline:
+        if not options.baseline:
+            log.warning('--update-baseline needs --baseline, ignored')
+        else:
+            bench.save_baseline(options.baseline, summaries)
+            log.info('Baseline %s updated', options.baseline)
+        return True
+
+    slower = bench.regressions(summaries, baseline, options.tolerance / 100)
+    for test, metric, old, new in slower:
+        log.error('REGRESSION: %s %s %.4g -> %.4g (%+.1f%%)', test, metric, old, new, (new / old - 1) * 100)
+
+    return not slower
+
+
+def run_worker(address):
+    setup_offline_cache()
+    client = WorkerClient(parse_address(address))
+    log.info('Connected to coordinator %s', address)
+    try:
+        history = History(options.history_file)
+        client.run(lambda tests: run_all(tests, history))
+    finally:
+        client.close()
+
+    return True
 
 
 def main():
     parse_args()
     logconfig.init(getattr(logging, options.log))
-    run_timelines(options.timelines)
+    if options.benchmark and (options.serve or options.connect):
+        parser.error('--benchmark runs locally, it can not be combined with --serve or --connect')
+
+    if options.connect:
+        ok = run_worker(options.connect)
+    elif options.timelines:
+        ok = run_timelines(options.timelines)
+    else:
+        parser.error('timelines is required unless running as a worker (--connect)')
+
+    if not ok:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
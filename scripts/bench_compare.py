@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Per-compare latency of capture-and-compare metrics.
+#
+#   python scripts/bench_compare.py
+#   python scripts/bench_compare.py --size 1920x1080 --repeat 50
+
+# -- stdlib --
+from pathlib import Path
+import argparse
+import sys
+import timeit
+
+# -- third party --
+import numpy as np
+
+# -- own --
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils import imgdiff
+
+
+# -- code --
+def main():
+    parser = argparse.ArgumentParser('bench_compare')
+    parser.add_argument('--size', action='append', help='WxH, can be given multiple times')
+    parser.add_argument('--repeat', type=int, default=20)
+    options = parser.parse_args()
+
+    sizes = options.size or ['512x512', '1024x1024', '1920x1080']
+    rng = np.random.default_rng(23333)
+
+    metrics = {
+        'rmse': imgdiff.rmse,
+        'sum-difference': imgdiff.sum_difference,
+        'pixel-count': imgdiff.pixel_count,
+        'blur-sum-difference': lambda a, b: imgdiff.sum_difference(imgdiff.gaussian_blur(a), imgdiff.gaussian_blur(b)),
+    }
+
+    print(f'{"size":>10} {"compare":>20} {"ms/compare":>12}')
+    for size in sizes:
+        w, h = map(int, size.split('x'))
+        a = rng.integers(0, 256, (w, h, 4), dtype=np.uint8)
+        b = a.copy()
+        noise = rng.integers(0, 3, (w, h, 3), dtype=np.uint8)
+        b[:, :, :3] = np.minimum(b[:, :, :3].astype(np.int32) + noise, 255).astype(np.uint8)
+
+        for name, f in metrics.items():
+            t = min(timeit.repeat(lambda: f(a, b), number=1, repeat=options.repeat))
+            print(f'{size:>10} {name:>20} {t * 1000:12.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+
+# -- stdlib --
+from pathlib import Path
+import sys
+
+# -- third party --
+# -- own --
+
+# -- code --
+# Modules of the runner are imported the way run.py does, from the repo root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
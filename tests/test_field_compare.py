@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+# -- stdlib --
+import importlib.util
+import os
+
+# -- third party --
+import numpy as np
+import pytest
+
+pytest.importorskip('taichi')
+
+# -- own --
+from actions.capture import WORK_DIR
+from actions.poke import field_compare
+from args import options, parser
+from exceptions import Failed
+
+
+# -- code --
+EXAMPLE = '''
+import numpy as np
+
+def main():
+    x = np.linspace(0, 1, 16)
+    step()
+'''
+
+
+@pytest.fixture
+def example(tmp_path, monkeypatch):
+    """
+    An example script, run the way run.py does: its path relative to where
+    the runner started, from within its own directory. Returns a function
+    running `main` with the given action called in place of a frame.
+    """
+    script = tmp_path / 'example.py'
+    script.write_text(EXAMPLE)
+    test = {'path': os.path.relpath(script, WORK_DIR), 'args': []}
+    options._set_options(parser.parse_args(['--save-compare-dir', str(tmp_path / 'bad-compare')]))
+    monkeypatch.chdir(tmp_path)
+
+    def run(action):
+        spec = importlib.util.spec_from_file_location('example', script)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        module.step = lambda: action(test)
+        module.main()
+
+    return run
+
+
+def compare(truth, result, function='main', **kwargs):
+    return lambda test: field_compare(
+        dry=False, function=function, expr='x', ground_truth=str(truth),
+        current_test=test, result=result, **kwargs,
+    )
+
+
+def test_generate_then_pass(example, tmp_path, monkeypatch):
+    truth = tmp_path / 'truths' / 'x.npz'
+    monkeypatch.setattr(options.obj, 'generate_captures', True)
+    example(compare(truth, None))
+    assert np.allclose(np.load(truth)['value'], np.linspace(0, 1, 16))
+
+    monkeypatch.setattr(options.obj, 'generate_captures', False)
+    result = {'captures': []}
+    example(compare(truth, result))
+    assert result['captures'][0]['stats']['mismatched'] == 0
+
+
+def test_mismatch_fails(example, tmp_path):
+    truth = tmp_path / 'x.npy'
+    bad = np.linspace(0, 1, 16)
+    bad[3] += 0.5
+    np.save(truth, bad)
+
+    result = {'captures': []}
+    with pytest.raises(Failed, match='1/16 elements off'):
+        example(compare(truth, result))
+    assert result['captures'][0]['stats']['max_abs'] == pytest.approx(0.5)
+    assert (tmp_path / 'bad-compare' / 'x.capture.npy').exists()
+
+    # Within tolerance
+    example(compare(truth, {'captures': []}, atol=0.6))
+
+
+def test_unknown_function(example, tmp_path):
+    with pytest.raises(ValueError, match='Cannot find function'):
+        example(compare(tmp_path / 'x.npy', {'captures': []}, function='nope'))
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+# -- stdlib --
+import argparse
+import time
+
+# -- third party --
+# -- own --
+from utils.resultdb import ResultDB
+
+
+# -- code --
+def main():
+    parser = argparse.ArgumentParser('trends')
+    parser.add_argument('--results-db', default='.release-tests/results.db')
+    parser.add_argument('--runs', type=int, default=10, help='Only look at the last N runs')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+
+    p = sub.add_parser('slowest')
+    p.add_argument('-n', type=int, default=20)
+
+    p = sub.add_parser('regressed')
+    p.add_argument('--threshold', type=float, default=15, help='Runtime growth in percent')
+
+    p = sub.add_parser('history')
+    p.add_argument('test')
+
+    options = parser.parse_args()
+    db = ResultDB(options.results_db)
+
+    if options.cmd == 'slowest':
+        for test, median, n in db.slowest(options.n, options.runs):
+            print(f'{median:8.2f}s  ({n} runs)  {test}')
+    elif options.cmd == 'regressed':
+        for test, before, latest, growth in db.regressions(options.threshold / 100, options.runs):
+            print(f'{growth * 100:+7.1f}%  {before:8.2f}s -> {latest:8.2f}s  {test}')
+    elif options.cmd == 'history':
+        for run_id, started, host, version, status, duration, error in db.test_history(options.test, options.runs):
+            when = time.strftime('%y%m%d %H:%M:%S', time.localtime(started))
+            print(f'#{run_id:<5} {when}  {host}  {version}  {status:6}  {duration or 0:8.2f}s  {error or ""}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+# -- stdlib --
+from pathlib import Path
+import json
+import logging
+import statistics
+
+# -- third party --
+import numpy as np
+
+# -- own --
+from utils.misc import save_json
+
+# -- code --
+log = logging.getLogger('bench')
+
+
+def summarize(runs):
+    """
+    Benchmark numbers of a test from the results of its measured runs.
+    The first frame of every run covers imports, JIT & window creation,
+    it's left out of frame times.
+    """
+    frames = np.array([t for r in runs for t in r['frame_times'][1:]], dtype=np.float64)
+    rst = {
+        'runs': len(runs),
+        'duration': statistics.median(r['duration'] for r in runs),
+        'frames': len(frames),
+    }
+    if len(frames):
+        rst['frame_median'] = float(np.median(frames))
+        rst['frame_p95'] = float(np.percentile(frames, 95))
+        rst['fps'] = float(len(frames) / frames.sum())
+    return rst
+
+
+def gated_metric(summary):
+    # Compute only examples (no frames) are judged by their duration
+    if 'frame_median' in summary:
+        return 'frame_median'
+    return 'duration'
+
+
+def regressions(summaries, baseline, tolerance):
+    """
+    [(test, metric, baseline value, current value), ...] for tests slower
+    than baseline by more than `tolerance` (a fraction).
+    """
+    rst = []
+    for test, s in summaries.items():
+        old = baseline.get(test)
+        if not old:
+            continue
+        metric = gated_metric(s)
+        if metric not in old:
+            continue
+        if s[metric] > old[metric] * (1 + tolerance):
+            rst.append((test, metric, old[metric], s[metric]))
+    return rst
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        log.warning('Baseline %s does not exist, nothing to compare with', path)
+        return {}
+
+
+def save_baseline(path, summaries):
+    # Only tests benchmarked this time are replaced
+    path = Path(path)
+    baseline = load_baseline(path) if path.exists() else {}
+    baseline.update(summaries)
+    save_json(path, baseline, indent=1, sort_keys=True)
+
+
+def format_table(summaries, baseline):
+    lines = [f'{"test":<60} {"median":>9} {"p95":>9} {"fps":>8} {"duration":>9} {"vs base":>8}']
+    for test, s in sorted(summaries.items()):
+        metric = gated_metric(s)
+        old = baseline.get(test, {}).get(metric)
+        delta = f'{(s[metric] / old - 1) * 100:+.1f}%' if old else '-'
+        if 'frame_median' in s:
+            frames = f'{s["frame_median"] * 1000:>7.2f}ms {s["frame_p95"] * 1000:>7.2f}ms {s["fps"]:>8.1f}'
+        else:
+            frames = f'{"-":>9} {"-":>9} {"-":>8}'
+        lines.append(f'{test[-60:]:<60} {frames} {s["duration"]:>8.2f}s {delta:>8}')
+    return '\n'.join(lines)
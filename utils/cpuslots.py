@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# -- stdlib --
+import logging
+import os
+
+# -- third party --
+# -- own --
+
+# -- code --
+log = logging.getLogger('cpuslots')
+
+# Thread pools of OpenMP / BLAS & friends, for libraries loaded from now on
+THREAD_ENV_VARS = (
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+)
+
+
+def available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def cpus_for(slot, workers, cpus):
+    # Contiguous share of `cpus` for the slot, neighbours tend to share caches.
+    # More workers than cpus: slots share single cpus round robin.
+    if workers >= len(cpus):
+        return [cpus[slot % len(cpus)]]
+
+    base, extra = divmod(len(cpus), workers)
+    start = slot * base + min(slot, extra)
+    return cpus[start:start + base + (slot < extra)]
+
+
+def pin(slot, workers):
+    """
+    Pin this process to its share of cpus, and cap thread pools to its
+    size. Returns the number of cpus this process got.
+    """
+    cpus = cpus_for(slot, workers, available_cpus())
+
+    if hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0, cpus)
+        except OSError:
+            log.warning('Cannot set cpu affinity of slot %d to %s', slot, cpus, exc_info=True)
+
+    n = len(cpus)
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(n)
+
+    # Already loaded BLAS (numpy's) won't look at the environment again
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(n)
+    except ImportError:
+        pass
+
+    return n
+
+
+def efficiency(results, expected, wall, workers):
+    """
+    How well `workers` parallel runners did. `expected` are durations
+    recorded in history before this run (tests without one count with
+    their current duration).
+
+    utilization: share of runner time spent running tests
+    slowdown:    tests took this much longer than recorded, contention
+    efficiency:  recorded total duration / (wall time * workers)
+    """
+    busy = sum(r['duration'] for r in results)
+    base = sum(expected.get(r['test']) or r['duration'] for r in results)
+    known = [r for r in results if expected.get(r['test'])]
+    capacity = wall * workers
+    return {
+        'workers': workers,
+        'wall': wall,
+        'utilization': busy / capacity if capacity else None,
+        'slowdown': sum(r['duration'] for r in known) / sum(expected[r['test']] for r in known) if known else None,
+        'efficiency': base / capacity if capacity else None,
+    }
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+# -- stdlib --
+from collections import deque
+import json
+import logging
+import queue
+import socket
+import socketserver
+import threading
+import time
+
+# -- third party --
+# -- own --
+from utils.history import test_key
+
+# -- code --
+log = logging.getLogger('dispatch')
+
+# Protocol: newline delimited JSON over TCP, worker asks & coordinator answers
+#
+#   worker -> {"op": "next"}
+#   coord  -> {"test": {...}} | {"wait": true} | {"done": true}
+#   worker -> {"op": "result", "result": {...}}
+#
+# "wait" means nothing is queued, but tests handed to other workers are not
+# finished yet and may come back if their worker goes away.
+
+
+def parse_address(s):
+    host, _, port = s.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+class Coordinator(object):
+    def __init__(self, address, tests):
+        self.pending = deque(tests)
+        self.total = len(tests)
+        self.in_flight = {}  # connection id -> [test, ...]
+        self.results = queue.Queue()
+        self.lock = threading.Lock()
+
+        coord = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                coord._serve(self)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer(address, Handler)
+        self.server.daemon_threads = True
+
+    def _serve(self, handler):
+        conn = id(handler)
+        peer = '%s:%s' % handler.client_address[:2]
+        log.info('Worker %s connected', peer)
+        with self.lock:
+            mine = self.in_flight[conn] = []
+
+        try:
+            for line in handler.rfile:
+                msg = json.loads(line)
+                if msg['op'] == 'next':
+                    with self.lock:
+                        if self.pending:
+                            test = self.pending.popleft()
+                            mine.append(test)
+                            reply = {'test': test}
+                        elif any(self.in_flight.values()):
+                            reply = {'wait': True}
+                        else:
+                            reply = {'done': True}
+                    _send(handler.wfile, reply)
+                elif msg['op'] == 'result':
+                    r = msg['result']
+                    with self.lock:
+                        test = next((t for t in mine if test_key(t) == r['test']), None)
+                        if test is None:
+                            log.warning('Unexpected result of %s from %s, ignored', r['test'], peer)
+                            continue
+                        mine.remove(test)
+                    self.results.put(r)
+        except (OSError, ValueError) as e:
+            log.warning('Worker %s: %s', peer, e)
+        finally:
+            with self.lock:
+                lost = self.in_flight.pop(conn)
+                # Put back to the front, someone else will take them
+                self.pending.extendleft(reversed(lost))
+            log.info('Worker %s disconnected, %d tests requeued', peer, len(lost))
+
+    def serve(self):
+        # Yields results as workers report them, until every test has one
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        log.info('Serving %d tests on %s:%s', self.total, *self.server.server_address[:2])
+        try:
+            for _ in range(self.total):
+                yield self.results.get()
+        finally:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+class WorkerClient(object):
+    def __init__(self, address):
+        self.sock = socket.create_connection(address)
+        self.rfile = self.sock.makefile('rb')
+        self.wfile = self.sock.makefile('wb')
+        self.done = False
+
+    def tests(self):
+        # Stops on "wait" as well, so the caller can deliver results of
+        # tests still running here before asking again
+        while True:
+            _send(self.wfile, {'op': 'next'})
+            line = self.rfile.readline()
+            if not line:
+                raise ConnectionError('Coordinator went away')
+            reply = json.loads(line)
+            if 'test' in reply:
+                yield reply['test']
+            else:
+                self.done = 'done' in reply
+                return
+
+    def send_result(self, result):
+        _send(self.wfile, {'op': 'result', 'result': result})
+
+    def run(self, run_all, poll=1.0):
+        while not self.done:
+            for r in run_all(self.tests()):
+                self.send_result(r)
+            if not self.done:
+                time.sleep(poll)
+
+    def close(self):
+        self.sock.close()
+
+
+def _send(wfile, msg):
+    wfile.write(json.dumps(msg).encode('utf-8') + b'\n')
+    wfile.flush()
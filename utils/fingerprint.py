@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+# -- stdlib --
+from pathlib import Path
+import ast
+import hashlib
+import json
+import logging
+
+# -- third party --
+# -- own --
+from utils.misc import load_json, save_json
+
+# -- code --
+log = logging.getLogger('fingerprint')
+
+
+def local_imports(script):
+    """
+    The script itself, plus every module it (transitively) imports from
+    its own directory tree. Installed packages are not followed.
+    """
+    root = Path(script).resolve().parent
+    seen = set()
+    todo = [Path(script).resolve()]
+
+    while todo:
+        path = todo.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+
+        try:
+            tree = ast.parse(path.read_bytes(), str(path))
+        except (OSError, SyntaxError, ValueError):
+            continue
+
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                candidates = [(root, a.name) for a in node.names]
+            elif isinstance(node, ast.ImportFrom):
+                base = root
+                if node.level:
+                    base = path.parent
+                    for _ in range(node.level - 1):
+                        base = base.parent
+                mod = node.module or ''
+                # `from pkg import mod` may import a submodule
+                candidates = [(base, mod)] + [(base, f'{mod}.{a.name}'.strip('.')) for a in node.names]
+            else:
+                continue
+
+            for base, name in candidates:
+                if not name:
+                    continue
+                p = base.joinpath(*name.split('.'))
+                for f in (p.with_suffix('.py'), p / '__init__.py'):
+                    if f.is_file():
+                        todo.append(f.resolve())
+
+    return seen
+
+
+class Fingerprinter(object):
+    def __init__(self, build):
+        self.build = build
+        self.hashes = {}
+
+    def hash_file(self, path):
+        path = Path(path).resolve()
+        if path not in self.hashes:
+            try:
+                self.hashes[path] = hashlib.sha1(path.read_bytes()).hexdigest()
+            except OSError:
+                self.hashes[path] = 'missing'
+        return self.hashes[path]
+
+    def __call__(self, test):
+        files = {test['timeline']} | local_imports(test['path'])
+        for step in test['steps']:
+            if 'ground_truth' in step['kwargs']:
+                files.add(step['kwargs']['ground_truth'])
+
+        h = hashlib.sha1()
+        h.update(self.build.encode('utf-8'))
+        h.update(json.dumps([test['path'], test.get('args', [])]).encode('utf-8'))
+        for f in sorted(str(Path(f).resolve()) for f in files):
+            h.update(f'{f}:{self.hash_file(f)}\n'.encode('utf-8'))
+
+        return h.hexdigest()
+
+
+class GreenRecord(object):
+    # Fingerprints of tests when they last passed, by `test_id`
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = self._load()
+        self.dirty = {}
+
+    def _load(self):
+        return load_json(self.path, 'green record') or {}
+
+    def is_green(self, key, fingerprint):
+        return self.entries.get(key) == fingerprint
+
+    def update(self, key, fingerprint):
+        # None marks the test as not green anymore
+        self.entries[key] = self.dirty[key] = fingerprint
+
+    def save(self):
+        if not self.dirty:
+            return
+
+        entries = self._load()
+        entries.update(self.dirty)
+        entries = {k: v for k, v in entries.items() if v is not None}
+
+        save_json(self.path, entries, indent=1, sort_keys=True)
+
+        self.entries = entries
+        self.dirty = {}
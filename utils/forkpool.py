@@ -0,0 +1,463 @@
+# -*- coding: utf-8 -*-
+
+# -- stdlib --
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import itertools
+import queue
+import logging
+import multiprocessing
+import os
+import pickle
+import selectors
+import signal
+import struct
+import sys
+import time
+import traceback
+
+# -- third party --
+# -- own --
+from utils.memory import current_rss
+
+# -- code --
+log = logging.getLogger('forkpool')
+
+
+class Admission(object):
+    """
+    Decides which pending item starts next. Without `cost` it's simply
+    FIFO. With it, items start in order as long as the costs of running
+    items stay within `budget`; an item that doesn't fit lets later ones
+    (within a lookahead of as many items as there are free slots) go first.
+    The first item always starts on an idle pool, so nothing waits forever.
+    """
+
+    def __init__(self, items, workers, cost=None, budget=None):
+        self.items = iter(items)
+        self.workers = workers
+        self.cost = cost if cost is not None and budget else None
+        self.budget = budget
+        self.pending = []
+        self.used = {}  # token -> cost
+        self.exhausted = False
+
+    def _fill(self, limit):
+        # Never hold more than needed: pulling items early takes them away
+        # from other consumers (see dispatch.py), and lets small items
+        # overtake big ones queued longest first
+        while not self.exhausted and len(self.pending) < limit:
+            try:
+                self.pending.append(next(self.items))
+            except StopIteration:
+                self.exhausted = True
+
+    def next(self):
+        free = self.workers - len(self.used)
+        if free <= 0:
+            return None
+
+        self._fill(free)
+        i = 0
+        while i < len(self.pending):
+            item = self.pending[i]
+            if self.cost is None:
+                del self.pending[i]
+                return item, 0
+
+            c = self.cost(item)
+            if not self.used or sum(self.used.values()) + c <= self.budget:
+                del self.pending[i]
+                return item, c
+
+            i += 1
+            if i == 1:
+                # Lookahead goes past the head that doesn't fit
+                self._fill(free + 1)
+
+        return None
+
+    def started(self, token, c):
+        self.used[token] = c
+
+    def finished(self, token):
+        del self.used[token]
+
+    def done(self):
+        self._fill(1)
+        return not self.pending and not self.used
+
+
+class PoolOptions(object):
+    """
+    workers:      number of items running at the same time
+    cost, budget: memory aware admission, see `Admission`
+    setup:        `setup(slot)` is called once in every worker process, slot
+                  being the index (0 ~ workers - 1) of the slot it occupies
+    max_items:    a worker process is replaced after running this many items
+    max_rss:      ... or once its RSS grew over this many bytes
+    timeout:      seconds an item may run, its worker is killed after that
+    failed:       `failed(item, reason, elapsed)` makes up a result for an item
+                  whose worker crashed or timed out. Without it the pool raises.
+    """
+
+    def __init__(self, workers, cost=None, budget=None, setup=None,
+                 max_items=1, max_rss=None, timeout=None, failed=None):
+        self.workers = workers
+        self.cost = cost
+        self.budget = budget
+        self.setup = setup
+        self.max_items = max_items
+        self.max_rss = max_rss
+        self.timeout = timeout
+        self.failed = failed
+
+    def fail(self, item, reason, elapsed):
+        if self.failed is None:
+            raise RuntimeError(f'Worker for {item!r} {reason}')
+        log.error('Worker for %r %s', item, reason)
+        return self.failed(item, reason, elapsed)
+
+
+class Worker(object):
+    def __init__(self, pid, slot, task_w, result_r):
+        self.pid = pid
+        self.slot = slot
+        self.task_w = task_w
+        self.result_r = result_r
+        self.buf = bytearray()
+        self.item = None
+        self.started = None
+        self.retiring = False
+
+
+class ForkPool(PoolOptions):
+    """
+    Runs items in worker processes forked from the (already warmed up)
+    current process. Workers start with everything the parent imported and
+    hooked. With the default `max_items=1` every item gets a fresh worker,
+    and never sees state left over by a previous item.
+
+    A worker that crashes or times out only fails its own item, the pool
+    carries on with fresh workers.
+    """
+
+    def _spawn(self, fn, slot, workers):
+        task_r, task_w = os.pipe()
+        result_r, result_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # -- child --
+            os.close(task_w)
+            os.close(result_r)
+            for w in workers:
+                os.close(w.task_w)
+                os.close(w.result_r)
+            code = 0
+            try:
+                if self.setup:
+                    self.setup(slot)
+                self._serve(fn, task_r, result_w)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+
+        os.close(task_r)
+        os.close(result_w)
+        return Worker(pid, slot, task_w, result_r)
+
+    def _serve(self, fn, task_r, result_w):
+        served = 0
+        while True:
+            item = _recv(task_r)
+            if item is None:
+                return
+
+            try:
+                payload = ('ok', fn(item))
+            except BaseException as e:
+                payload = ('error', ''.join(traceback.format_exception(type(e), e, e.__traceback__)))
+
+            served += 1
+            retire = served >= self.max_items or bool(self.max_rss and (current_rss() or 0) > self.max_rss)
+            _send(result_w, (payload, retire))
+            if retire:
+                return
+
+    def imap_unordered(self, fn, items):
+        admission = Admission(items, self.workers, self.cost, self.budget)
+        sel = selectors.DefaultSelector()
+        workers = {}  # result_r -> Worker
+        idle = []
+        slots = set(range(self.workers))
+
+        def remove(w):
+            sel.unregister(w.result_r)
+            os.close(w.result_r)
+            os.close(w.task_w)
+            del workers[w.result_r]
+            if w in idle:
+                idle.remove(w)
+            slots.add(w.slot)
+            if w.item is not None:
+                admission.finished(w.result_r)
+
+        try:
+            while True:
+                results = []
+                while idle or len(workers) < self.workers:
+                    nxt = admission.next()
+                    if nxt is None:
+                        break
+                    item, cost = nxt
+                    if idle:
+                        w = idle.pop()
+                    else:
+                        slot = min(slots)
+                        slots.remove(slot)
+                        w = self._spawn(fn, slot, workers.values())
+                        workers[w.result_r] = w
+                        sel.register(w.result_r, selectors.EVENT_READ)
+                    w.item, w.started = item, time.time()
+                    admission.started(w.result_r, cost)
+                    try:
+                        _send(w.task_w, item)
+                    except BrokenPipeError:
+                        remove(w)
+                        _kill(w.pid)
+                        results.append(self.fail(item, 'exited before taking the item', 0))
+
+                if admission.done() and not results:
+                    return
+
+                timeout = None
+                if self.timeout:
+                    busy = [w.started for w in workers.values() if w.item is not None]
+                    if busy:
+                        timeout = max(0, min(busy) + self.timeout - time.time())
+
+                for key, _ in sel.select(timeout) if workers else []:
+                    w = workers[key.fd]
+                    data = os.read(w.result_r, 1 << 20)
+                    if data:
+                        w.buf += data
+                        for payload, retire in _frames(w.buf):
+                            results.append(self._collect(w.item, payload, time.time() - w.started))
+                            admission.finished(w.result_r)
+                            w.item = None
+                            w.retiring = retire
+                            if not retire:
+                                idle.append(w)
+                        continue
+
+                    # EOF, worker exited
+                    item, elapsed = w.item, time.time() - (w.started or 0)
+                    remove(w)
+                    _, status = os.waitpid(w.pid, 0)
+                    if item is not None:
+                        results.append(self.fail(item, f'died without a result ({_describe(status)})', elapsed))
+                    elif not w.retiring:
+                        log.warning('Idle worker %d exited (%s)', w.pid, _describe(status))
+
+                if self.timeout:
+                    for w in list(workers.values()):
+                        if w.item is not None and time.time() - w.started > self.timeout:
+                            item, elapsed = w.item, time.time() - w.started
+                            remove(w)
+                            _kill(w.pid)
+                            results.append(self.fail(item, f'timed out after {self.timeout}s, killed', elapsed))
+
+                yield from results
+        finally:
+            for w in list(workers.values()):
+                w.item = None
+                remove(w)
+                _kill(w.pid)
+            sel.close()
+
+    def _collect(self, item, payload, elapsed):
+        kind, payload = payload
+        if kind == 'error':
+            return self.fail(item, f'raised:\n{payload}', elapsed)
+        return payload
+
+
+class ExecutorPool(PoolOptions):
+    """
+    Same interface as ForkPool, for platforms without fork(). Workers are
+    recycled by `max_items` only (Python 3.11+). A crash or timeout breaks
+    the whole executor, items that happened to run along are retried one
+    by one on a fresh one.
+    """
+
+    def _executor(self):
+        # What platforms without fork() have anyway, and max_tasks_per_child needs
+        ctx = multiprocessing.get_context('spawn')
+        # Workers report their pids, the executor doesn't tell (publicly)
+        pids = ctx.Queue()
+        slots = None
+        if self.setup:
+            # Worker processes are long lived here, each takes a slot when it starts
+            slots = ctx.Queue()
+            for i in range(self.workers):
+                slots.put(i)
+        kwargs = {'mp_context': ctx, 'initializer': _init_worker, 'initargs': (pids, slots, self.setup)}
+        if sys.version_info >= (3, 11):
+            kwargs['max_tasks_per_child'] = self.max_items
+        return ProcessPoolExecutor(max_workers=self.workers, **kwargs), pids
+
+    def imap_unordered(self, fn, items):
+        admission = Admission(items, self.workers, self.cost, self.budget)
+        tokens = itertools.count()
+        retry = []
+        running = {}  # future -> (token, item, started)
+        pool, pids = self._executor()
+        try:
+            while True:
+                while len(running) < self.workers:
+                    if retry:
+                        if running:
+                            break  # Suspects of a crash run alone, to tell who it was
+                        token, item = retry.pop(0)
+                    else:
+                        nxt = admission.next()
+                        if nxt is None:
+                            break
+                        item, cost = nxt
+                        token = next(tokens)
+                        admission.started(token, cost)
+                    running[pool.submit(fn, item)] = (token, item, time.time())
+
+                if admission.done():
+                    return
+
+                timeout = None
+                if self.timeout:
+                    timeout = max(0, min(s for _, _, s in running.values()) + self.timeout - time.time())
+
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                results = []
+                broken = False
+                for fut in done:
+                    token, item, started = running[fut]
+                    try:
+                        results.append(fut.result())
+                    except BrokenProcessPool:
+                        broken = True
+                        continue
+                    except Exception as e:
+                        results.append(self.fail(item, f'raised {type(e).__name__}: {e}', time.time() - started))
+                    del running[fut]
+                    admission.finished(token)
+
+                now = time.time()
+                expired = {fut for fut, (_, _, s) in running.items() if self.timeout and now - s > self.timeout}
+                if expired or broken:
+                    # There's no killing a single worker, start over with a fresh executor
+                    for pid in _drain(pids):
+                        _terminate(pid)
+                    for fut in running:
+                        fut.cancel()
+                    pool.shutdown(wait=True)
+                    for fut, (token, item, started) in running.items():
+                        if fut in expired:
+                            results.append(self.fail(item, f'timed out after {self.timeout}s, killed', now - started))
+                        elif len(running) == 1:
+                            results.append(self.fail(item, 'died without a result', now - started))
+                        else:
+                            retry.append((token, item))
+                            continue
+                        admission.finished(token)
+                    running = {}
+                    pool, pids = self._executor()
+
+                yield from results
+        finally:
+            for fut in running:
+                fut.cancel()
+            pool.shutdown(wait=False)
+
+
+def make_pool(workers, **kwargs):
+    if hasattr(os, 'fork'):
+        return ForkPool(workers, **kwargs)
+    else:
+        return ExecutorPool(workers, **kwargs)
+
+
+def _init_worker(pids, slots, setup):
+    pids.put(os.getpid())
+    if setup:
+        setup(slots.get())
+
+
+def _drain(q):
+    rst = []
+    while True:
+        try:
+            rst.append(q.get_nowait())
+        except queue.Empty:
+            return rst
+
+
+def _terminate(pid):
+    # No SIGKILL on Windows, where SIGTERM is TerminateProcess
+    try:
+        os.kill(pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+    except OSError:
+        pass
+
+
+def _send(fd, obj):
+    # Length prefixed pickle
+    data = pickle.dumps(obj)
+    view = memoryview(struct.pack('<Q', len(data)) + data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _read_exact(fd, n):
+    buf = bytearray()
+    while len(buf) < n:
+        data = os.read(fd, n - len(buf))
+        if not data:
+            return None
+        buf += data
+    return bytes(buf)
+
+
+def _recv(fd):
+    # None on EOF
+    head = _read_exact(fd, 8)
+    if head is None:
+        return None
+    return pickle.loads(_read_exact(fd, struct.unpack('<Q', head)[0]))
+
+
+def _frames(buf):
+    # Complete messages in `buf` are consumed, a partial one stays
+    while len(buf) >= 8:
+        n = struct.unpack_from('<Q', buf)[0]
+        if len(buf) < 8 + n:
+            return
+        obj = pickle.loads(bytes(buf[8:8 + n]))
+        del buf[:8 + n]
+        yield obj
+
+
+def _kill(pid):
+    try:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+    except (ProcessLookupError, ChildProcessError):
+        pass
+
+
+def _describe(status):
+    if os.WIFSIGNALED(status):
+        return f'killed by signal {os.WTERMSIG(status)}'
+    return f'exit code {os.WEXITSTATUS(status)}'
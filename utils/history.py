@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+# -- stdlib --
+from pathlib import Path
+import logging
+import statistics
+
+# -- third party --
+# -- own --
+from utils.misc import load_json, save_json
+
+# -- code --
+log = logging.getLogger('history')
+
+# Number of recent samples kept per test, expected duration is their median
+KEEP_SAMPLES = 5
+
+# Used when nothing at all is known about the suite
+DEFAULT_DURATION = 60.0
+
+
+def test_key(test):
+    # A single example may appear in several timelines with different args,
+    # so path alone is not enough to identify a test across runs.
+    return ' '.join([str(test['path'])] + [str(a) for a in test.get('args', [])])
+
+
+def test_id(test):
+    # ... and even a test key may appear in several timelines
+    return f"{test['timeline']}:{test_key(test)}"
+
+
+class History(object):
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = self._load()
+        self.dirty = {}
+
+    def _load(self):
+        return load_json(self.path, 'history file') or {}
+
+    def expected(self, key):
+        samples = self.entries.get(key, {}).get('durations')
+        if not samples:
+            return None
+        return statistics.median(samples)
+
+    def peak_rss(self, key):
+        # Worst of recent samples, memory is planned for the bad case
+        samples = self.entries.get(key, {}).get('peak_rss')
+        if not samples:
+            return None
+        return max(samples)
+
+    def record(self, key, duration, peak_rss=None):
+        for entries in (self.entries, self.dirty):
+            ent = entries.setdefault(key, {})
+            ent['durations'] = (ent.get('durations', []) + [round(duration, 3)])[-KEEP_SAMPLES:]
+            if peak_rss is not None:
+                ent['peak_rss'] = (ent.get('peak_rss', []) + [peak_rss])[-KEEP_SAMPLES:]
+
+    def save(self):
+        if not self.dirty:
+            return
+
+        # Other runs may share this file, merge our samples into whatever is on disk now
+        entries = self._load()
+        for key, ent in self.dirty.items():
+            old = entries.setdefault(key, {})
+            old['durations'] = (old.get('durations', []) + ent['durations'])[-KEEP_SAMPLES:]
+            if 'peak_rss' in ent:
+                old['peak_rss'] = (old.get('peak_rss', []) + ent['peak_rss'])[-KEEP_SAMPLES:]
+
+        save_json(self.path, entries, indent=1, sort_keys=True)
+
+        self.entries = entries
+        self.dirty = {}
+
+    def estimate(self, tests):
+        # Tests without history get the median of the known ones
+        known = {test_key(t): self.expected(test_key(t)) for t in tests}
+        durations = [v for v in known.values() if v is not None]
+        fallback = statistics.median(durations) if durations else DEFAULT_DURATION
+        return [fallback if known[test_key(t)] is None else known[test_key(t)] for t in tests]
+
+    def longest_first(self, tests):
+        est = self.estimate(tests)
+        order = sorted(range(len(tests)), key=lambda i: -est[i])
+        return [tests[i] for i in order]
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+# -- stdlib --
+# -- third party --
+import numpy as np
+
+# -- own --
+
+# -- code --
+# Image metrics for capture-and-compare, in plain NumPy so comparing never
+# touches the taichi runtime of the example under test.
+#
+# Images are (w, h, 3) arrays as `ti.tools.imread` gives (sliced to RGB).
+# Results match what the former taichi kernels computed: same integer types,
+# same float32 arithmetic in the same order. Sums are exact here, where the
+# kernels accumulated with (order dependent) atomics.
+
+# def _get_gaussian_coef(radius):
+#     from math import erfc
+#     a = 3.0 / radius * 0.707106781
+#     f = lambda x: 0.5*erfc(-x*a)
+#     l = [f(0.5 + i) - f(-0.5 + i) for i in range(radius+1)]
+#     l = [i for i in l if i>0.01]
+#     l = list(reversed(l[1:])) + l
+#     s = sum(l)
+#     l = [i/s for i in l]
+#     return l
+
+
+GAUSSIAN_COEFF = np.array([
+    0.01449797497581252,
+    0.04928451699227458,
+    0.11807162656393803,
+    0.19941115896256947,
+    0.23746944501081074,
+    0.19941115896256947,
+    0.11807162656393803,
+    0.04928451699227458,
+    0.01449797497581252,
+], dtype=np.float32)
+
+GAUSSIAN_RADIUS = len(GAUSSIAN_COEFF) // 2
+
+
+def _rgb(img):
+    return np.asarray(img)[:, :, :3]
+
+
+def _i16(img):
+    return _rgb(img).astype(np.int16)
+
+
+def _squares_sum(a, b):
+    a, b = _i16(a), _i16(b)
+    assert a.shape == b.shape
+    v = np.subtract(a, b, out=a)
+    # Squares & channel sum were done in i16, wrapping around on large differences
+    v *= v
+    sq = v[:, :, 0] + v[:, :, 1]
+    sq += v[:, :, 2]
+    return int(sq.sum(dtype=np.int64))
+
+
+def _rmse_of(acc, w, h):
+    return float(np.sqrt(np.float32(acc) / np.float32(w) / np.float32(h)))
+
+
+def rmse(a, b):
+    return _rmse_of(_squares_sum(a, b), a.shape[0], a.shape[1])
+
+
+def sum_difference(a, b):
+    a, b = _rgb(a), _rgb(b)
+    assert a.shape == b.shape
+    if a.dtype == b.dtype == np.uint8:
+        # |a - b| without widening
+        d = np.maximum(a, b)
+        d -= np.minimum(a, b)
+    else:
+        d = np.abs(a.astype(np.int16) - b)
+    return int(d.sum(dtype=np.int64))
+
+
+def pixel_count(a, b):
+    a, b = _rgb(a), _rgb(b)
+    assert a.shape == b.shape
+    ne = a != b
+    m = ne[:, :, 0] | ne[:, :, 1]
+    m |= ne[:, :, 2]
+    return int(np.count_nonzero(m))
+
+
+def _blur_flat(flat, stride):
+    # 1-D pass over the row-major flattened image, `stride` apart.
+    # Reads past the image borders wrap into the neighbouring row,
+    # and read zeros beyond the ends, like the kernel on a packed field.
+    n = flat.shape[0]
+    pad = GAUSSIAN_RADIUS * stride
+    padded = np.zeros((n + 2 * pad, 3), dtype=np.float32)
+    padded[pad:pad + n] = flat
+    acc = np.zeros((n, 3), dtype=np.float32)
+    tmp = np.empty_like(acc)
+    for k, c in enumerate(GAUSSIAN_COEFF):
+        off = k * stride
+        np.multiply(padded[off:off + n], c, out=tmp)
+        acc += tmp
+    return acc.astype(np.int16)
+
+
+def gaussian_blur(img):
+    img = _i16(img)
+    w, h, _ = img.shape
+    flat = img.reshape(w * h, 3)
+    aux = _blur_flat(flat, 1)    # along j
+    out = _blur_flat(aux, h)     # along i
+    return out.reshape(w, h, 3)
+
+
+def naive_downscale(img):
+    # 2x2 box filter, for retina captures
+    img = np.asarray(img, dtype=np.uint16)
+    acc = img[0::2, 0::2] + img[0::2, 1::2] + img[1::2, 0::2] + img[1::2, 1::2]
+    return (acc // 4).astype(np.uint8)
+
+
+# -- pyramid --
+# No level is smaller than this
+PYRAMID_MIN_SIZE = 8
+
+
+def _pyramid(img, levels):
+    # Level k holds sums over 2^k x 2^k blocks, odd edges are dropped
+    cur = _rgb(img).astype(np.int32)
+    rst = [cur]
+    for _ in range(levels):
+        if cur.shape[0] // 2 < PYRAMID_MIN_SIZE or cur.shape[1] // 2 < PYRAMID_MIN_SIZE:
+            break
+        w, h = cur.shape[0] // 2 * 2, cur.shape[1] // 2 * 2
+        cur = cur[0:w:2, 0:h:2] + cur[1:w:2, 0:h:2] + cur[0:w:2, 1:h:2] + cur[1:w:2, 1:h:2]
+        rst.append(cur)
+    return rst
+
+
+def pyramid_sum_difference(a, b, threshold, level=1):
+    """
+    Sum difference of a and b after averaging 2^level x 2^level blocks, scaled
+    back to full resolution units (so thresholds read like `sum-difference`),
+    forgiving sub-pixel noise.
+
+    Coarser levels are compared first. Their error never exceeds the error of
+    finer levels, so exceeding `threshold` there rejects early (`exact` False,
+    `diff` a lower bound). Passing always takes comparing `level` itself.
+
+    Returns (diff, exact).
+    """
+    pa = _pyramid(a, level + 16)
+    pb = _pyramid(b, level + 16)
+    level = min(level, len(pa) - 1)
+
+    for k in range(len(pa) - 1, level, -1):
+        diff = int(np.abs(pa[k] - pb[k]).sum(dtype=np.int64))
+        if diff > threshold and k + 1 < len(rows):
+            return diff, False
+
+    return int(np.abs(pa[level] - pb[level]).sum(dtype=np.int64)), True
+
+
+# -- tile hashes --
+TILE = 32
+
+# Fixed odd weights, hashes stay comparable across runs
+_TILE_WEIGHTS = np.random.default_rng(23333).integers(0, 2**63, (1, TILE, 1, TILE, 3), dtype=np.uint64) * 2 + 1
+
+
+def tile_hashes(img):
+    """
+    A (ceil(w / TILE), ceil(h / TILE)) array of 64-bit hashes, one for every
+    TILE x TILE block of the RGB channels.
+    """
+    img = _rgb(img)
+    w, h, _ = img.shape
+    tw, th = -(-w // TILE), -(-h // TILE)
+    padded = np.zeros((tw * TILE, th * TILE, 3), dtype=np.uint64)
+    padded[:w, :h] = img
+    padded = padded.reshape(tw, TILE, th, TILE, 3)
+    padded *= _TILE_WEIGHTS  # wraps around, as intended
+    return padded.sum(axis=(1, 3, 4), dtype=np.uint64)
+
+
+def _dilate(m):
+    # Tiles next to any set one, diagonals included
+    rst = m.copy()
+    rst[1:] |= m[:-1]
+    rst[:-1] |= m[1:]
+    m = rst.copy()
+    rst[:, 1:] |= m[:, :-1]
+    rst[:, :-1] |= m[:, 1:]
+    return rst
+
+
+def _runs(idx):
+    # [start, stop) of consecutive runs in sorted indices
+    splits = np.flatnonzero(np.diff(idx) > 1) + 1
+    return [(int(r[0]), int(r[-1]) + 1) for r in np.split(idx, splits)]
+
+
+def _blur_window(img, i0, i1, j0, j1):
+    # gaussian_blur(img)[i0:i1, j0:j1], blurring only what it reads
+    w, h, _ = img.shape
+    r = GAUSSIAN_RADIUS
+    if j0 < r or j1 + r > h:
+        # Reads wrap into neighbouring rows, take them whole
+        c0, c1 = 0, h
+    else:
+        c0, c1 = j0 - r, j1 + r
+    # One more row each side for the wrapped reads of the first pass
+    r0, r1 = max(i0 - r - 1, 0), min(i1 + r + 1, w)
+    slab = np.ascontiguousarray(img[r0:r1, c0:c1])
+    sw = c1 - c0
+    aux = _blur_flat(slab.reshape(-1, 3), 1)
+    out = _blur_flat(aux, sw).reshape(r1 - r0, sw, 3)
+    return out[i0 - r0:i1 - r0, j0 - c0:j1 - c0]
+
+
+def blur_sum_difference(a, b, threshold, b_tiles):
+    """
+    `sum-difference` of blurred a and b, blurring only around tiles whose
+    hashes differ (blur radius is well within a tile, anywhere else the
+    blurred images are identical). Stops once a row of tiles takes it
+    over `threshold`.
+
+    Returns (diff, exact).
+    """
+    a, b = _i16(a), _i16(b)
+    assert a.shape == b.shape
+    w, h, _ = a.shape
+    if h <= GAUSSIAN_RADIUS:
+        # Reads wrap across several rows, hardly worth it anyway
+        return sum_difference(gaussian_blur(a), gaussian_blur(b)), True
+
+    differ = tile_hashes(a) != b_tiles
+    # The first pass reads past the right border into the next row and
+    # vice versa, so do the tiles there
+    edge = (h - GAUSSIAN_RADIUS) // TILE
+    near = differ.copy()
+    near[:, 0] |= differ[:, edge:].any(axis=1)
+    near[:, edge:] |= differ[:, :1]
+    need = _dilate(near)
+
+    diff = 0
+    rows = np.flatnonzero(need.any(axis=1))
+    for k, ti in enumerate(rows):
+        i0, i1 = ti * TILE, min((ti + 1) * TILE, w)
+        for t0, t1 in _runs(np.flatnonzero(need[ti])):
+            j0, j1 = t0 * TILE, min(t1 * TILE, h)
+            diff += sum_difference(_blur_window(a, i0, i1, j0, j1), _blur_window(b, i0, i1, j0, j1))
+        if diff > threshold and k + 1 < len(rows):
+            return diff, False
+
+    return diff, True
+
+
+METRICS = {
+    'sum-difference': sum_difference,
+    'pixel-count': pixel_count,
+    'rmse': rmse,
+}
+
+
+def compare(method, a, b, threshold, level=1, b_tiles=None):
+    """
+    Compute `method` of a against b. Returns (diff, exact), `exact` is False
+    when the comparison stopped early, `diff` is a lower bound then, which
+    is enough to fail it.
+
+    `b_tiles` (the tile hashes of b) lets blur-sum-difference blur only
+    where the images differ. Other metrics are about as cheap as hashing itself.
+    """
+    if method == 'pyramid-sum-difference':
+        return pyramid_sum_difference(a, b, threshold, level)
+
+    if method == 'blur-sum-difference':
+        if b_tiles is not None:
+            return blur_sum_difference(a, b, threshold, b_tiles)
+        return sum_difference(gaussian_blur(a), gaussian_blur(b)), True
+
+    return METRICS[method](a, b), True
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+# -- stdlib --
+# -- third party --
+# -- own --
+
+# -- code --
+class KernelStats(object):
+    """
+    Where kernel time goes, per kernel (python function) name:
+
+    frontend:     AST transform & IR construction (`Kernel.materialize`)
+    first_launch: first launch of each instance, includes backend codegen
+                  or loading it from offline cache
+    launch_time:  all other launches, wall time seen from python. Async
+                  on GPU backends, see `device_time` there.
+    device_time:  from taichi's kernel profiler, when enabled
+    """
+
+    FIELDS = ('instances', 'frontend', 'first_launch', 'launches', 'launch_time')
+
+    def __init__(self):
+        self.kernels = {}
+        self.launched = set()
+        self.device_time = None
+
+    def _get(self, name):
+        if name not in self.kernels:
+            self.kernels[name] = dict.fromkeys(self.FIELDS, 0)
+        return self.kernels[name]
+
+    def materialized(self, name, duration):
+        k = self._get(name)
+        k['instances'] += 1
+        k['frontend'] += duration
+
+    def first_launch(self, t_kernel):
+        # Instances live as long as the test, their id is good enough
+        if id(t_kernel) in self.launched:
+            return False
+        self.launched.add(id(t_kernel))
+        return True
+
+    def launch(self, name, duration, first):
+        k = self._get(name)
+        if first:
+            k['first_launch'] += duration
+        else:
+            k['launches'] += 1
+            k['launch_time'] += duration
+
+    def summary(self):
+        jit = sum(k['frontend'] + k['first_launch'] for k in self.kernels.values())
+        run = sum(k['launch_time'] for k in self.kernels.values())
+        return {
+            'jit': jit,
+            'run': run,
+            'device_time': self.device_time,
+            'kernels': {name: dict(k) for name, k in self.kernels.items()},
+        }
+
+
+def format_table(summary, limit=10):
+    kernels = sorted(
+        summary['kernels'].items(),
+        key=lambda kv: kv[1]['frontend'] + kv[1]['first_launch'] + kv[1]['launch_time'],
+        reverse=True,
+    )
+
+    lines = [f'{"kernel":<32} {"inst":>5} {"frontend":>9} {"1st launch":>10} {"launches":>8} {"run":>9}']
+    for name, k in kernels[:limit]:
+        lines.append(
+            f'{name[:32]:<32} {k["instances"]:>5} {k["frontend"]:>8.3f}s {k["first_launch"]:>9.3f}s '
+            f'{k["launches"]:>8} {k["launch_time"]:>8.3f}s'
+        )
+    if len(kernels) > limit:
+        lines.append(f'... {len(kernels) - limit} more kernels')
+
+    total = f'jit {summary["jit"]:.3f}s, run {summary["run"]:.3f}s'
+    if summary['device_time'] is not None:
+        total += f', device {summary["device_time"]:.3f}s'
+    lines.append(total)
+    return '\n'.join(lines)
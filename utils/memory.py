@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+# -- stdlib --
+import os
+import re
+import sys
+
+# -- third party --
+# -- own --
+
+# -- code --
+try:
+    import resource
+except ImportError:
+    resource = None  # Windows
+
+UNITS = {'': 2**20, 'K': 2**10, 'M': 2**20, 'G': 2**30}
+
+
+def parse_size(v):
+    """
+    `memory_budget` values: plain numbers are MB, strings may carry a
+    unit like `512M`, `1.5GB`. Returns bytes.
+    """
+    if isinstance(v, (int, float)):
+        return int(v * UNITS[''])
+
+    m = re.fullmatch(r'\s*([0-9.]+)\s*([KMG]?)B?\s*', str(v), re.I)
+    if not m:
+        raise ValueError(f'Invalid memory size: {v!r}')
+    return int(float(m.group(1)) * UNITS[m.group(2).upper()])
+
+
+def physical_memory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _status(field):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def current_rss():
+    # None without /proc (non Linux)
+    return _status('VmRSS:')
+
+
+def _faults():
+    if resource is None:
+        return 0, 0
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    return ru.ru_minflt, ru.ru_majflt
+
+
+class MemoryProbe(object):
+    """
+    Peak RSS and page faults of this process from construction on.
+
+    Peak RSS is only per test if the high water mark can be reset, i.e.
+    on Linux through /proc/self/clear_refs. Elsewhere it's the peak of
+    the whole process, still exact when every test runs in a fresh fork.
+    """
+
+    def __init__(self):
+        try:
+            # Resets VmHWM
+            with open('/proc/self/clear_refs', 'w') as f:
+                f.write('5')
+        except OSError:
+            pass
+        self.faults = _faults()
+
+    def peak_rss(self):
+        hwm = _status('VmHWM:')
+        if hwm is not None:
+            return hwm
+        if resource is None:
+            return None
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024
+
+    def finish(self):
+        minflt, majflt = _faults()
+        return {
+            'peak_rss': self.peak_rss(),
+            'minor_faults': minflt - self.faults[0],
+            'major_faults': majflt - self.faults[1],
+        }
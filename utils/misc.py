@@ -1,12 +1,21 @@
 # -*- coding: utf-8 -*-
 
 # -- stdlib --
+from contextlib import contextmanager
 from functools import wraps
+from pathlib import Path
+import json
+import logging
+import os
+import threading
 
 # -- third party --
 # -- own --
 
 # -- code --
+log = logging.getLogger('misc')
+
+
 def hook(module, name=None):
     def inner(hooker):
         funcname = name or hooker.__name__
@@ -19,3 +28,36 @@ def hook(module, name=None):
         setattr(module, funcname, real_hooker)
         return real_hooker
     return inner
+
+
+@contextmanager
+def atomic_write(path, mode='w'):
+    # Written to a temporary file first, so other runners reading `path`
+    # never see it half written. Compare threads may write the same path
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        with open(tmp, mode) as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def load_json(path, what='file'):
+    # None if missing or corrupted
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        log.warning('Ignoring corrupted %s %s', what, path)
+        return None
+
+
+def save_json(path, obj, **kwargs):
+    with atomic_write(path) as f:
+        json.dump(obj, f, **kwargs)
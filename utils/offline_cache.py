@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+# -- stdlib --
+from contextlib import contextmanager
+from pathlib import Path
+import logging
+import os
+import shutil
+
+# -- third party --
+# -- own --
+
+# -- code --
+log = logging.getLogger('offline_cache')
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class OfflineCache(object):
+    """
+    Kernel offline cache shared by all tests and runners.
+
+    Caches live in `<root>/<build>/<arch>`, where build identifies the taichi
+    version & commit, so a rebuilt taichi never picks up stale kernels.
+    Whole build directories are evicted in LRU order when `root` grows over
+    `max_size` bytes. Within the current build, taichi itself evicts
+    kernels in LRU order, see `init_kwargs`.
+    """
+
+    def __init__(self, root, build, max_size):
+        # Tests run in the directory of their example, keep pointing here
+        self.root = Path(root).resolve()
+        self.build = build
+        self.max_size = max_size
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def dir_for(self, arch):
+        d = self.root / self.build / arch
+        d.mkdir(parents=True, exist_ok=True)
+        (self.root / self.build / '.last-used').touch()
+        return d
+
+    def init_kwargs(self, arch):
+        # For `ti.init`, taichi cleans the cache of an arch when it exits
+        return {
+            'offline_cache_file_path': str(self.dir_for(arch)),
+            'offline_cache_max_size_of_files': self.max_size,
+            'offline_cache_cleaning_policy': 'lru',
+        }
+
+    @contextmanager
+    def _lock(self, kind):
+        if fcntl is None:
+            yield True
+            return
+
+        with open(self.root / '.lock', 'a') as f:
+            try:
+                fcntl.flock(f, kind)
+            except BlockingIOError:
+                yield False
+                return
+
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @contextmanager
+    def using(self):
+        # Held while a test runs, eviction waits for all users to go away
+        with self._lock(fcntl and fcntl.LOCK_SH):
+            yield
+
+    def evict(self):
+        with self._lock(fcntl and fcntl.LOCK_EX | fcntl.LOCK_NB) as locked:
+            if not locked:
+                log.debug('Offline cache in use, skip eviction')
+                return
+
+            builds = []
+            for d in self.root.iterdir():
+                if not d.is_dir():
+                    continue
+                marker = d / '.last-used'
+                used = marker.stat().st_mtime if marker.exists() else 0
+                builds.append((used, _du(d), d))
+
+            total = sum(b[1] for b in builds)
+            for used, size, d in sorted(builds):
+                if total <= self.max_size:
+                    break
+                if d.name == self.build:
+                    continue
+                log.info('Evicting offline cache %s (%.1f MB)', d.name, size / 2**20)
+                shutil.rmtree(d, ignore_errors=True)
+                total -= size
+
+            if total > self.max_size:
+                log.warning('Offline cache of current build alone exceeds %.1f MB', self.max_size / 2**20)
+
+
+def arch_key(arch):
+    # `arch` as passed to ti.init, could be None, a single arch or a list (ti.gpu)
+    import taichi as ti
+
+    env = os.environ.get('TI_ARCH')
+    if env:
+        return env
+    if arch is None:
+        return 'default'
+    if isinstance(arch, (list, tuple)):
+        return 'gpu'
+    return ti._lib.core.arch_name(arch)
+
+
+def _du(path):
+    total = 0
+    for dirp, _, filenames in os.walk(path):
+        for fn in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirp, fn))
+            except OSError:
+                pass
+    return total
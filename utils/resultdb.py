@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+# -- stdlib --
+from pathlib import Path
+import sqlite3
+import statistics
+import time
+
+# -- third party --
+# -- own --
+
+# -- code --
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    host TEXT,
+    taichi_version TEXT,
+    taichi_commit TEXT
+);
+
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    test TEXT NOT NULL,
+    status TEXT NOT NULL,
+    duration REAL,
+    error TEXT,
+    finished REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_by_test ON results(test, run_id);
+
+CREATE TABLE IF NOT EXISTS steps (
+    result_id INTEGER NOT NULL REFERENCES results(id),
+    idx INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    frame INTEGER,
+    duration REAL
+);
+
+CREATE TABLE IF NOT EXISTS captures (
+    result_id INTEGER NOT NULL REFERENCES results(id),
+    ground_truth TEXT,
+    compare TEXT,
+    diff REAL,
+    threshold REAL,
+    exact INTEGER  -- 0: comparison stopped early, diff is a lower bound
+);
+
+CREATE TABLE IF NOT EXISTS measures (
+    result_id INTEGER NOT NULL REFERENCES results(id),
+    name TEXT NOT NULL,
+    frames INTEGER,
+    fps REAL,
+    median REAL,
+    p95 REAL,
+    max REAL
+);
+
+CREATE TABLE IF NOT EXISTS memory (
+    result_id INTEGER NOT NULL REFERENCES results(id),
+    peak_rss INTEGER,
+    minor_faults INTEGER,
+    major_faults INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS kernel_totals (
+    result_id INTEGER NOT NULL REFERENCES results(id),
+    jit REAL,
+    run REAL,
+    device_time REAL
+);
+
+CREATE TABLE IF NOT EXISTS kernels (
+    result_id INTEGER NOT NULL REFERENCES results(id),
+    kernel TEXT NOT NULL,
+    instances INTEGER,
+    frontend REAL,
+    first_launch REAL,
+    launches INTEGER,
+    launch_time REAL
+);
+'''
+
+
+class ResultDB(object):
+    def __init__(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Parallel runs may share the database, wait for the lock instead of failing
+        self.conn = sqlite3.connect(str(path), timeout=60)
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        # Columns added to tables of existing databases
+        cols = {r[1] for r in self.conn.execute('PRAGMA table_info(captures)')}
+        if 'exact' not in cols:
+            with self.conn:
+                self.conn.execute('ALTER TABLE captures ADD COLUMN exact INTEGER')
+
+    def close(self):
+        self.conn.close()
+
+    def begin_run(self, host, taichi_version, taichi_commit):
+        with self.conn:
+            cur = self.conn.execute(
+                'INSERT INTO runs (started, host, taichi_version, taichi_commit) VALUES (?, ?, ?, ?)',
+                (time.time(), host, taichi_version, taichi_commit),
+            )
+        return cur.lastrowid
+
+    def add_result(self, run_id, result):
+        with self.conn:
+            cur = self.conn.execute(
+                'INSERT INTO results (run_id, test, status, duration, error, finished) VALUES (?, ?, ?, ?, ?, ?)',
+                (run_id, result['test'], result['status'], result.get('duration'), result.get('error'), time.time()),
+            )
+            rid = cur.lastrowid
+            self.conn.executemany(
+                'INSERT INTO steps (result_id, idx, action, frame, duration) VALUES (?, ?, ?, ?, ?)',
+                [(rid, i, s['action'], s.get('frame'), s.get('duration')) for i, s in enumerate(result.get('steps', []))],
+            )
+            self.conn.executemany(
+                'INSERT INTO captures (result_id, ground_truth, compare, diff, threshold, exact) VALUES (?, ?, ?, ?, ?, ?)',
+                [
+                    (rid, c['ground_truth'], c['compare'], c['diff'], c['threshold'], c.get('exact', True))
+                    for c in result.get('captures', [])
+                ],
+            )
+            self.conn.executemany(
+                'INSERT INTO measures (result_id, name, frames, fps, median, p95, max) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [
+                    (rid, name, m['frames'], m.get('fps'), m.get('median'), m.get('p95'), m.get('max'))
+                    for name, m in result.get('measures', {}).items()
+                ],
+            )
+            mem = result.get('memory')
+            if mem:
+                self.conn.execute(
+                    'INSERT INTO memory (result_id, peak_rss, minor_faults, major_faults) VALUES (?, ?, ?, ?)',
+                    (rid, mem['peak_rss'], mem['minor_faults'], mem['major_faults']),
+                )
+            kernels = result.get('kernels')
+            if kernels:
+                self.conn.execute(
+                    'INSERT INTO kernel_totals (result_id, jit, run, device_time) VALUES (?, ?, ?, ?)',
+                    (rid, kernels['jit'], kernels['run'], kernels['device_time']),
+                )
+                self.conn.executemany(
+                    'INSERT INTO kernels (result_id, kernel, instances, frontend, first_launch, launches, launch_time) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [
+                        (rid, name, k['instances'], k['frontend'], k['first_launch'], k['launches'], k['launch_time'])
+                        for name, k in kernels['kernels'].items()
+                    ],
+                )
+        return rid
+
+    def _recent_durations(self, runs):
+        # {test: [duration, ...]} of passed results in the last `runs` runs, oldest first
+        rows = self.conn.execute(
+            '''
+            SELECT test, duration FROM results
+            WHERE status = 'passed' AND run_id IN (SELECT id FROM runs ORDER BY id DESC LIMIT ?)
+            ORDER BY run_id, id
+            ''',
+            (runs,),
+        )
+        rst = {}
+        for test, duration in rows:
+            rst.setdefault(test, []).append(duration)
+        return rst
+
+    def slowest(self, limit=20, runs=10):
+        durations = self._recent_durations(runs)
+        rst = [(test, statistics.median(d), len(d)) for test, d in durations.items()]
+        rst.sort(key=lambda r: -r[1])
+        return rst[:limit]
+
+    def regressions(self, threshold=0.15, runs=10):
+        # Latest duration against the median of the earlier ones in the window
+        rst = []
+        for test, d in self._recent_durations(runs).items():
+            if len(d) < 2:
+                continue
+            before = statistics.median(d[:-1])
+            if before > 0 and d[-1] / before - 1 > threshold:
+                rst.append((test, before, d[-1], d[-1] / before - 1))
+        rst.sort(key=lambda r: -r[3])
+        return rst
+
+    def test_history(self, test, runs=10):
+        return self.conn.execute(
+            '''
+            SELECT r.id, r.started, r.host, r.taichi_version, x.status, x.duration, x.error
+            FROM results x JOIN runs r ON x.run_id = r.id
+            WHERE x.test = ?
+            ORDER BY r.id DESC LIMIT ?
+            ''',
+            (test, runs),
+        ).fetchall()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+# -- stdlib --
+import argparse
+
+# -- third party --
+# -- own --
+
+# -- code --
+def parse_shard(s):
+    try:
+        k, n = map(int, s.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Expecting K/N, got {s!r}')
+
+    if not 1 <= k <= n:
+        raise argparse.ArgumentTypeError(f'Shard {s!r} out of range')
+
+    return k, n
+
+
+def partition(keys, estimates, n):
+    """
+    Split into `n` shards of about the same expected duration (greedy, longest
+    first). Only depends on the keys and estimates, not on their order, so
+    every host computes the same partition given the same estimates. Without
+    estimates shards get the same number of tests.
+
+    Returns a list of `n` lists of indices into `keys`.
+    """
+    if estimates is None:
+        estimates = [1.0] * len(keys)
+
+    order = sorted(range(len(keys)), key=lambda i: (-estimates[i], keys[i]))
+    shards = [[] for _ in range(n)]
+    loads = [0.0] * n
+    for i in order:
+        s = min(range(n), key=lambda j: (loads[j], j))
+        shards[s].append(i)
+        loads[s] += estimates[i]
+
+    return shards
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+# -- stdlib --
+from dataclasses import dataclass
+from pathlib import Path
+import hashlib
+import logging
+
+# -- third party --
+import yaml
+
+# -- own --
+from actions import ACTIONS
+from utils.memory import parse_size
+from utils.misc import load_json, save_json
+
+# -- code --
+log = logging.getLogger('timeline')
+
+# Bump when the compiled representation changes, old cache entries are ignored
+TIMELINE_FORMAT = 3
+
+# libyaml backed loader is several times faster, if PyYAML is built with it
+YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Supplied by the runner when a step runs, never taken from the timeline
+RUNTIME_ARGS = ('dry', 'gui', 'current_test', 'result')
+
+
+@dataclass
+class Step:
+    frame: int
+    action: str
+    func: object
+    kwargs: dict
+    runtime: tuple
+
+
+def compile_steps(steps, test=None):
+    """
+    Validate steps and turn them into plain dicts with absolute frame
+    numbers. Actions that take `dry` are dry run once here, like
+    collecting used to do.
+    """
+    rst = []
+    last = 0
+    for step in steps:
+        if 'action' not in step:
+            raise ValueError(f'Step {step} has no action!')
+        if step['action'] not in ACTIONS:
+            raise ValueError(f'Unknown action {step["action"]}!')
+
+        fr = step['frame']
+        if isinstance(fr, str) and fr.startswith('@'):
+            fr = int(fr[1:])
+        else:
+            fr = last + int(fr)
+        last = fr
+
+        action = ACTIONS[step['action']]
+        # All of them, the cache outlives changes to what actions accept
+        kwargs = {k: v for k, v in step.items() if k not in ('frame', 'action') + RUNTIME_ARGS}
+        if 'dry' in action.params:
+            runtime = {'dry': True, 'gui': None, 'current_test': test, 'result': None}
+            action(**_accepted(action, kwargs), **{k: v for k, v in runtime.items() if k in action.params})
+
+        rst.append({'frame': fr, 'action': step['action'], 'kwargs': kwargs})
+
+    return rst
+
+
+def resolve_steps(steps, work_dir):
+    """
+    Compiled steps -> `Step`s ready to run, with only the arguments
+    their action accepts. Paths are made absolute here, so actions don't
+    depend on the current directory.
+    """
+    rst = []
+    for step in steps:
+        action = ACTIONS[step['action']]
+        kwargs = _accepted(action, step['kwargs'])
+        if 'ground_truth' in kwargs:
+            kwargs['ground_truth'] = str(Path(work_dir) / kwargs['ground_truth'])
+        runtime = tuple(k for k in RUNTIME_ARGS if k in action.params)
+        rst.append(Step(step['frame'], step['action'], action, kwargs, runtime))
+
+    return rst
+
+
+def _accepted(action, kwargs):
+    return {k: v for k, v in kwargs.items() if k in action.params}
+
+
+class TimelineCache(object):
+    """
+    Compiled timelines, one JSON file per timeline. An entry is reused
+    while the timeline's mtime & size stay the same, or when its content
+    hash still matches after a touch.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def _entry_path(self, path):
+        name = hashlib.sha1(str(Path(path).resolve()).encode('utf-8')).hexdigest()
+        return self.root / f'{name}.json'
+
+    def _read(self, entry):
+        cached = load_json(entry, 'timeline cache')
+        if not cached or cached.get('format') != TIMELINE_FORMAT:
+            return None
+
+        return cached
+
+    def load(self, path):
+        path = Path(path)
+        entry = self._entry_path(path)
+        st = path.stat()
+        stamp = [st.st_mtime_ns, st.st_size]
+
+        cached = self._read(entry)
+        if cached and cached['stamp'] == stamp:
+            return cached['tests']
+
+        content = path.read_bytes()
+        digest = hashlib.sha1(content).hexdigest()
+        if cached and cached['digest'] == digest:
+            cached['stamp'] = stamp
+            save_json(entry, cached)
+            return cached['tests']
+
+        log.debug('Compiling %s', path)
+        tests = yaml.load(content, Loader=YamlLoader)
+        for test in tests:
+            test['steps'] = compile_steps(test['steps'], test)
+            if 'memory_budget' in test:
+                test['memory_budget'] = parse_size(test['memory_budget'])
+
+        save_json(entry, {'format': TIMELINE_FORMAT, 'stamp': stamp, 'digest': digest, 'tests': tests})
+        return tests
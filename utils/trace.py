@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+# -- stdlib --
+from contextlib import contextmanager
+from pathlib import Path
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+# -- third party --
+# -- own --
+
+# -- code --
+log = logging.getLogger('trace')
+
+# Tracer of the test running in this process, spans are dropped when None
+ACTIVE = None
+
+
+def now():
+    # Wall clock in microseconds, so traces of different processes line up
+    return time.time_ns() // 1000
+
+
+class Tracer(object):
+    """
+    Collects spans in Chrome trace event format, viewable with
+    chrome://tracing or https://ui.perfetto.dev
+    """
+
+    def __init__(self, name):
+        self.pid = os.getpid()
+        self.events = [{
+            'ph': 'M', 'name': 'process_name', 'pid': self.pid, 'tid': 0,
+            'args': {'name': name},
+        }]
+        self.threads = set()
+
+    def complete(self, name, cat, start, end, **args):
+        tid = threading.get_ident()
+        if tid not in self.threads:
+            self.threads.add(tid)
+            self.events.append({
+                'ph': 'M', 'name': 'thread_name', 'pid': self.pid, 'tid': tid,
+                'args': {'name': threading.current_thread().name},
+            })
+
+        self.events.append({
+            'ph': 'X', 'name': name, 'cat': cat, 'pid': self.pid, 'tid': tid,
+            'ts': start, 'dur': end - start, 'args': args,
+        })
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+
+def start(name):
+    global ACTIVE
+    ACTIVE = Tracer(name)
+    return ACTIVE
+
+
+def stop():
+    global ACTIVE
+    tracer, ACTIVE = ACTIVE, None
+    return tracer
+
+
+@contextmanager
+def span(name, cat, **args):
+    tracer = ACTIVE
+    if tracer is None:
+        yield
+        return
+
+    b4 = now()
+    try:
+        yield
+    finally:
+        tracer.complete(name, cat, b4, now(), **args)
+
+
+def file_name(key):
+    return re.sub(r'[^\w.-]+', '_', key).strip('_') + '.json'
+
+
+def merge(paths, out):
+    # Timestamps are absolute, concatenating puts all runners on one timeline
+    events = []
+    for p in paths:
+        try:
+            with open(p) as f:
+                events.extend(json.load(f)['traceEvents'])
+        except (OSError, ValueError, KeyError):
+            log.warning('Cannot read trace %s, not merged', p)
+
+    out = Path(out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+# -- stdlib --
+from pathlib import Path
+import hashlib
+
+# -- third party --
+import numpy as np
+
+# -- own --
+from utils import imgdiff
+from utils.misc import atomic_write
+
+# -- code --
+class TruthStore(object):
+    """
+    Decoded ground truth images, as `.npy` files named after the hash of the
+    PNG they come from. Loaded memory-mapped, so parallel runners share the
+    pages instead of each decoding the same PNGs. A changed PNG has a
+    different hash, stale entries are simply never looked up again.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.digests = {}  # path -> (mtime_ns, size, digest)
+
+    def digest(self, png):
+        png = Path(png)
+        st = png.stat()
+        cached = self.digests.get(png)
+        if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+            return cached[2]
+
+        digest = hashlib.sha1(png.read_bytes()).hexdigest()
+        self.digests[png] = (st.st_mtime_ns, st.st_size, digest)
+        return digest
+
+    def path_for(self, png, suffix='.npy'):
+        return self.root / f'{self.digest(png)}{suffix}'
+
+    def load(self, png):
+        npy = self.path_for(png)
+        if not npy.exists():
+            import taichi as ti
+            self._save(npy, ti.tools.imread(str(png)))
+
+        return np.load(npy, mmap_mode='r')
+
+    def tiles(self, png, img):
+        # Tile hash index of the (already decoded) `img`, see `imgdiff.compare`
+        npy = self.path_for(png, f'.tiles{imgdiff.TILE}.npy')
+        if not npy.exists():
+            self._save(npy, imgdiff.tile_hashes(img))
+
+        return np.load(npy)
+
+    def put(self, png, img):
+        # `img` was just written to `png`
+        self._save(self.path_for(png), img)
+
+    def _save(self, npy, img):
+        with atomic_write(npy, 'wb') as f:
+            np.save(f, np.ascontiguousarray(img))